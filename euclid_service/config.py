@@ -5,16 +5,29 @@
 提供统一的配置加载和访问接口
 """
 
+import copy
 import os
 import yaml
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 from string import Template
 
+try:
+    # libyaml的C实现，解析速度约为纯Python SafeLoader的10倍
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # 未编译libyaml时回退到纯Python实现
+    from yaml import SafeLoader as _YamlLoader
+
 
 class Config:
     """统一配置管理类"""
 
+    # 已解析的YAML内容，键为(文件绝对路径, 修改时间)，文件未变时不再重复解析
+    _yaml_cache: Dict[Tuple[str, float], Dict[str, Any]] = {}
+
+    # load()选中的配置文件，键为(config_path, EUCLID_CONFIG, 当前目录)
+    _resolved_path_cache: Dict[Tuple[Optional[str], Optional[str], str], Path] = {}
+
     def __init__(self, config_dict: Dict[str, Any]):
         """
         初始化配置
@@ -23,6 +36,8 @@ class Config:
             config_dict: 配置字典
         """
         self._config = config_dict
+        # get()的点号路径查找结果缓存，set()时清空
+        self._get_cache: Dict[str, Any] = {}
         self._resolve_variables()
 
     @classmethod
@@ -37,13 +52,20 @@ class Config:
             Config实例
         """
         path = Path(path).expanduser()
-        if not path.exists():
-            raise FileNotFoundError(f"配置文件不存在: {path}")
+        try:
+            cache_key = (str(path.resolve()), path.stat().st_mtime)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"配置文件不存在: {path}") from None
 
-        with open(path, 'r', encoding='utf-8') as f:
-            config_dict = yaml.safe_load(f)
+        config_dict = cls._yaml_cache.get(cache_key)
+        if config_dict is None:
+            # 以字节读入，由loader自行识别编码
+            with open(path, 'rb') as f:
+                config_dict = yaml.load(f, Loader=_YamlLoader)
+            cls._yaml_cache[cache_key] = config_dict
 
-        return cls(config_dict)
+        # 各实例可能通过set修改配置，缓存内容只以副本交出
+        return cls(copy.deepcopy(config_dict))
 
     @classmethod
     def from_env(cls, prefix: str = "EUCLID_") -> 'Config':
@@ -76,6 +98,14 @@ class Config:
         Returns:
             Config实例
         """
+        env_config_path = os.environ.get("EUCLID_CONFIG")
+        cache_key = (str(config_path) if config_path else None, env_config_path, os.getcwd())
+
+        # 之前选中的文件仍存在时直接使用，不再逐个检查候选路径
+        cached_path = cls._resolved_path_cache.get(cache_key)
+        if cached_path is not None and cached_path.exists():
+            return cls.from_yaml(str(cached_path))
+
         # 默认配置文件路径
         default_paths = [
             Path.cwd() / "config.yaml",
@@ -84,7 +114,6 @@ class Config:
         ]
 
         # 从环境变量获取配置文件路径
-        env_config_path = os.environ.get("EUCLID_CONFIG")
         if env_config_path:
             default_paths.insert(0, Path(env_config_path))
 
@@ -95,6 +124,7 @@ class Config:
         # 尝试加载配置文件
         for path in default_paths:
             if path.exists():
+                cls._resolved_path_cache[cache_key] = path
                 return cls.from_yaml(str(path))
 
         raise FileNotFoundError(
@@ -103,21 +133,25 @@ class Config:
 
     def _resolve_variables(self):
         """解析配置中的变量引用（如 ${data.root}）"""
-        self._config = self._resolve_dict(self._config)
+        # 变量字典（扁平化配置）只构建一次，所有值共用
+        variables = self._flatten_config(self._config)
+        self._config = self._resolve_dict(self._config, variables)
 
-    def _resolve_dict(self, d: Dict) -> Dict:
-        """递归解析字典中的变量"""
+    def _resolve_dict(self, d: Dict, variables: Dict) -> Dict:
+        """递归解析字典中的变量（YAML只产生普通dict/list，按精确类型分派）"""
+        resolve = self._resolve_value
         result = {}
         for key, value in d.items():
-            if isinstance(value, dict):
-                result[key] = self._resolve_dict(value)
-            elif isinstance(value, list):
-                result[key] = [self._resolve_value(v) for v in value]
+            value_type = type(value)
+            if value_type is dict:
+                result[key] = self._resolve_dict(value, variables)
+            elif value_type is list:
+                result[key] = [resolve(v, variables) for v in value]
             else:
-                result[key] = self._resolve_value(value)
+                result[key] = resolve(value, variables)
         return result
 
-    def _resolve_value(self, value: Any) -> Any:
+    def _resolve_value(self, value: Any, variables: Dict) -> Any:
         """解析单个值中的变量"""
         if not isinstance(value, str):
             return value
@@ -128,23 +162,24 @@ class Config:
 
         # 使用Template进行变量替换
         try:
-            # 构建变量字典（扁平化配置）
-            variables = self._flatten_config(self._config)
             template = Template(value)
             return template.safe_substitute(variables)
         except Exception:
             return value
 
     def _flatten_config(self, d: Dict, parent_key: str = '') -> Dict:
-        """将嵌套字典扁平化为点号分隔的键"""
-        items = []
-        for k, v in d.items():
-            new_key = f"{parent_key}.{k}" if parent_key else k
-            if isinstance(v, dict):
-                items.extend(self._flatten_config(v, new_key).items())
-            else:
-                items.append((new_key, v))
-        return dict(items)
+        """将嵌套字典扁平化为点号分隔的键（迭代遍历，直接写入同一个结果字典）"""
+        flat = {}
+        stack = [(parent_key, d)]
+        while stack:
+            prefix, current = stack.pop()
+            for k, v in current.items():
+                new_key = f"{prefix}.{k}" if prefix else k
+                if isinstance(v, dict):
+                    stack.append((new_key, v))
+                else:
+                    flat[new_key] = v
+        return flat
 
     def get(self, key: str, default: Any = None) -> Any:
         """
@@ -157,15 +192,20 @@ class Config:
         Returns:
             配置值
         """
-        keys = key.split('.')
-        value = self._config
+        try:
+            return self._get_cache[key]
+        except KeyError:
+            pass
 
-        for k in keys:
+        value = self._config
+        for k in key.split('.'):
             if isinstance(value, dict) and k in value:
                 value = value[k]
             else:
+                # 不存在的键不缓存，default可能每次不同
                 return default
 
+        self._get_cache[key] = value
         return value
 
     def set(self, key: str, value: Any):
@@ -178,6 +218,8 @@ class Config:
         """
         keys = key.split('.')
         config = self._config
+        # 修改任一路径都可能影响以它为前缀或作为其前缀的缓存项
+        self._get_cache.clear()
 
         for k in keys[:-1]:
             if k not in config:
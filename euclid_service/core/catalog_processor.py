@@ -47,42 +47,41 @@ def load_catalog(
     else:
         raise ValueError(f"不支持的文件格式: {catalog_path.suffix}")
 
-    # 自动检测列名
-    columns = [col.upper() for col in catalog.colnames]
+    # 自动检测列名：大写列名 -> 原列名（大小写重名时取第一个）
+    col_map = {col.upper(): col for col in reversed(catalog.colnames)}
 
     # 检测 RA 列
     if ra_col is None:
         ra_candidates = ['RA', 'RA_DEG', 'ALPHA_J2000', 'ALPHAWIN_J2000']
-        for candidate in ra_candidates:
-            if candidate in columns:
-                ra_col = catalog.colnames[columns.index(candidate)]
-                break
+        ra_col = next((col_map[c] for c in ra_candidates if c in col_map), None)
         if ra_col is None:
             raise ValueError("无法自动检测RA列，请手动指定")
 
     # 检测 DEC 列
     if dec_col is None:
         dec_candidates = ['DEC', 'DEC_DEG', 'DELTA_J2000', 'DELTAWIN_J2000']
-        for candidate in dec_candidates:
-            if candidate in columns:
-                dec_col = catalog.colnames[columns.index(candidate)]
-                break
+        dec_col = next((col_map[c] for c in dec_candidates if c in col_map), None)
         if dec_col is None:
             raise ValueError("无法自动检测DEC列，请手动指定")
 
     # 检测 ID 列
     if id_col is None:
         id_candidates = ['TARGETID', 'TARGET_ID', 'ID', 'SOURCE_ID', 'NUMBER']
-        for candidate in id_candidates:
-            if candidate in columns:
-                id_col = catalog.colnames[columns.index(candidate)]
-                break
+        id_col = next((col_map[c] for c in id_candidates if c in col_map), None)
 
     logger.info(f"加载星表: {catalog_path}, 行数: {len(catalog)}, RA列: {ra_col}, DEC列: {dec_col}, ID列: {id_col}")
 
     return catalog, ra_col, dec_col, id_col
 
 
+def _as_float_array(column) -> np.ndarray:
+    """将列转换为普通浮点ndarray，掩码值记为NaN"""
+    values = np.ma.asarray(column)
+    if values.dtype.kind != 'f':
+        values = values.astype(np.float64)
+    return np.ma.filled(values, np.nan)
+
+
 def get_catalog_statistics(catalog: Table, ra_col: str, dec_col: str) -> dict:
     """
     获取星表统计信息
@@ -95,22 +94,30 @@ def get_catalog_statistics(catalog: Table, ra_col: str, dec_col: str) -> dict:
     Returns:
         统计信息字典
     """
-    ra_data = catalog[ra_col]
-    dec_data = catalog[dec_col]
-
-    # 过滤有效坐标
-    valid_mask = np.isfinite(ra_data) & np.isfinite(dec_data)
-    valid_ra = ra_data[valid_mask]
-    valid_dec = dec_data[valid_mask]
+    # 转换为普通浮点数组（掩码值记为NaN），有效性掩码只计算一次
+    ra_values = _as_float_array(catalog[ra_col])
+    dec_values = _as_float_array(catalog[dec_col])
+    valid_mask = np.isfinite(ra_values) & np.isfinite(dec_values)
+    num_valid = int(np.count_nonzero(valid_mask))
+
+    ra_range = dec_range = ra_mean = dec_mean = None
+    if num_valid > 0:
+        # 全部有效时直接使用原数组，省去布尔索引的复制
+        valid_ra = ra_values if num_valid == len(ra_values) else ra_values[valid_mask]
+        valid_dec = dec_values if num_valid == len(dec_values) else dec_values[valid_mask]
+        ra_range = [float(valid_ra.min()), float(valid_ra.max())]
+        dec_range = [float(valid_dec.min()), float(valid_dec.max())]
+        ra_mean = float(valid_ra.mean())
+        dec_mean = float(valid_dec.mean())
 
     stats = {
         'num_rows': len(catalog),
-        'num_valid_coords': int(np.sum(valid_mask)),
-        'num_invalid_coords': int(len(catalog) - np.sum(valid_mask)),
-        'ra_range': [float(np.min(valid_ra)), float(np.max(valid_ra))] if len(valid_ra) > 0 else None,
-        'dec_range': [float(np.min(valid_dec)), float(np.max(valid_dec))] if len(valid_dec) > 0 else None,
-        'ra_mean': float(np.mean(valid_ra)) if len(valid_ra) > 0 else None,
-        'dec_mean': float(np.mean(valid_dec)) if len(valid_dec) > 0 else None,
+        'num_valid_coords': num_valid,
+        'num_invalid_coords': len(catalog) - num_valid,
+        'ra_range': ra_range,
+        'dec_range': dec_range,
+        'ra_mean': ra_mean,
+        'dec_mean': dec_mean,
         'columns': catalog.colnames
     }
 
@@ -6,12 +6,38 @@
 """
 
 import logging
+from pathlib import Path
 from typing import Optional
+import numpy as np
 from euclid_service.core.euclid_cutout_remix import query_tile_id as _query_tile_id
+from euclid_service.core.euclid_cutout_remix import query_tile_ids as _query_tile_ids
+from euclid_service.core.euclid_cutout_remix import preload_tile_index as _preload_tile_index
 
 logger = logging.getLogger(__name__)
 
 
+def _default_tile_index_file() -> str:
+    """默认的TILE坐标文件路径"""
+    return str(Path(__file__).parent.parent.parent / "data/EuclidQ1_tile_coordinates.fits")
+
+
+def preload_tile_index(tile_index_file: Optional[str] = None) -> int:
+    """
+    预先加载TILE索引到进程内缓存（服务或worker启动时调用），之后的查询不再解析FITS
+
+    Args:
+        tile_index_file: TILE坐标文件路径（可选）
+
+    Returns:
+        索引中的TILE数量
+    """
+    if tile_index_file is None:
+        tile_index_file = _default_tile_index_file()
+    n_tiles = _preload_tile_index(tile_index_file)
+    logger.info(f"已加载TILE索引: {tile_index_file}, 共 {n_tiles} 个TILE")
+    return n_tiles
+
+
 def query_tile_id(ra: float, dec: float, tile_index_file: Optional[str] = None) -> Optional[str]:
     """
     根据坐标查询TILE ID
@@ -27,8 +53,7 @@ def query_tile_id(ra: float, dec: float, tile_index_file: Optional[str] = None)
     try:
         # 如果未指定文件，使用默认路径
         if tile_index_file is None:
-            from pathlib import Path
-            tile_index_file = str(Path(__file__).parent.parent.parent / "data/EuclidQ1_tile_coordinates.fits")
+            tile_index_file = _default_tile_index_file()
 
         # 调用底层函数
         tile_id = _query_tile_id(ra, dec, tile_index_file=tile_index_file)
@@ -50,12 +75,19 @@ def batch_query_tile_ids(coordinates: list, tile_index_file: Optional[str] = Non
     Returns:
         TILE ID列表
     """
-    results = []
-    for ra, dec in coordinates:
-        tile_id = query_tile_id(ra, dec, tile_index_file)
-        results.append({
-            'ra': ra,
-            'dec': dec,
-            'tile_id': tile_id
-        })
-    return results
+    if tile_index_file is None:
+        tile_index_file = _default_tile_index_file()
+
+    try:
+        # TILE索引只加载一次（底层缓存KD树），所有坐标按数组一次性查询
+        coords = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        tile_ids = _query_tile_ids(coords[:, 0], coords[:, 1], tile_index_file)
+    except (TypeError, ValueError) as e:
+        # 坐标无法整体转换为数值数组时逐个查询，单个坐标出错只影响该坐标
+        logger.warning(f"坐标无法批量转换，改为逐个查询: {e}")
+        tile_ids = [query_tile_id(ra, dec, tile_index_file) for ra, dec in coordinates]
+
+    logger.info(f"批量查询 {len(tile_ids)} 个坐标，匹配到TILE的有 "
+                f"{sum(tile_id is not None for tile_id in tile_ids)} 个")
+    return [{'ra': ra, 'dec': dec, 'tile_id': tile_id}
+            for (ra, dec), tile_id in zip(coordinates, tile_ids)]
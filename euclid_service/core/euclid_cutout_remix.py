@@ -38,107 +38,339 @@ renhaoye@shao.ac.cn
 
 from astropy.io import fits
 from astropy.table import Table
-from astropy.wcs import WCS
-from astropy.nddata import Cutout2D
-from astropy.coordinates import SkyCoord
+from astropy.wcs import WCS, Sip
+from astropy.nddata.utils import overlap_slices
+from scipy.spatial import cKDTree
 import numpy as np
+import functools
+import copy
+import io
 import os
+import queue
+import re
 import sys
+import contextlib
+import logging
+import logging.handlers
+import multiprocessing
+import threading
+import time
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed, ThreadPoolExecutor
-from typing import Union, Optional, Tuple, List, Dict
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Union, Optional, Tuple, List, Dict, Callable
 import warnings
 warnings.filterwarnings('ignore', message='invalid value encountered in log10')
 
+try:
+    import fitsio  # cfitsio封装，可按窗口直接读取像素
+except ImportError:  # 可选依赖，未安装时回退到astropy.io.fits
+    fitsio = None
+
+try:
+    import zarr  # 可选依赖，仅output_format='zarr'时需要
+except ImportError:
+    zarr = None
+
+logger = logging.getLogger(__name__)
+
 
 # ============================================================================
 # 文件查找和TILE管理
 # ============================================================================
 
+def _read_radec_columns(catalog_file: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """只读取TILE catalog（HDU 1）的RA/DEC两列
+
+    安装了fitsio时由cfitsio按列读取；否则通过astropy memmap访问列视图，
+    不构建完整的Table。
+
+    返回:
+        (ra, dec) 或 None（没有可识别的坐标列）
+    """
+    def pick_columns(colnames):
+        if 'RIGHT_ASCENSION' in colnames and 'DECLINATION' in colnames:
+            return 'RIGHT_ASCENSION', 'DECLINATION'
+        elif 'RA' in colnames and 'DEC' in colnames:
+            return 'RA', 'DEC'
+        return None
+
+    if fitsio is not None:
+        with fitsio.FITS(catalog_file) as fits_file:
+            columns = pick_columns(fits_file[1].get_colnames())
+            if columns is None:
+                return None
+            data = fits_file[1].read(columns=list(columns))
+            return data[columns[0]], data[columns[1]]
+
+    with fits.open(catalog_file, memmap=True) as hdul:
+        data = hdul[1].data
+        columns = pick_columns(data.columns.names)
+        if columns is None:
+            return None
+        return (np.array(data[columns[0]], dtype=np.float64),
+                np.array(data[columns[1]], dtype=np.float64))
+
+
+def _scan_one_tile(tile_id: str, tile_path: str,
+                   catalog_regex: re.Pattern) -> Optional[Tuple[str, np.ndarray, np.ndarray]]:
+    """读取单个TILE目录下catalog的RA/DEC列，用于generate_tile_index的线程池
+
+    返回:
+        (tile_id, ra, dec) 或 None（没有catalog文件、坐标列或读取出错）
+    """
+    try:
+        with os.scandir(tile_path) as entries:
+            catalog_files = [e.name for e in entries if catalog_regex.search(e.name)]
+        if not catalog_files:
+            return None
+        
+        catalog_file = os.path.join(tile_path, catalog_files[0])
+        radec = _read_radec_columns(catalog_file)
+        if radec is None:
+            return None
+        return (tile_id,) + radec
+    
+    except Exception as e:
+        print(f"处理TILE {tile_id} 时出错: {e}")
+        return None
+
+
 def generate_tile_index(tile_catalog_root: str, output_file: str, 
-                        catalog_pattern: str = 'EUC_MER_FINAL-CAT_TILE') -> Table:
+                        catalog_pattern: str = 'EUC_MER_FINAL-CAT_TILE',
+                        n_workers: int = 16) -> Table:
     """生成TILE坐标索引
     
     参数:
         tile_catalog_root: TILE catalog文件的根目录
         output_file: 索引输出文件路径
         catalog_pattern: catalog文件名匹配模式
+        n_workers: 读取catalog的线程数（I/O密集，线程即可并发）
     """
-    tile_info_list = []
-    tile_dirs = [d for d in os.listdir(tile_catalog_root)
-                 if os.path.isdir(os.path.join(tile_catalog_root, d))]
+    catalog_regex = re.compile(rf'{re.escape(catalog_pattern)}.*\.fits$')
+    with os.scandir(tile_catalog_root) as entries:
+        tile_dirs = [(e.name, e.path) for e in entries if e.is_dir()]
     
-    for tile_id in tqdm(tile_dirs, desc="扫描TILE"):
-        tile_path = os.path.join(tile_catalog_root, tile_id)
-        try:
-            catalog_files = [f for f in os.listdir(tile_path)
-                           if catalog_pattern in f and f.endswith('.fits')]
-            if not catalog_files:
+    # 按列预分配数组（Structure-of-Arrays），逐个TILE填充
+    n_dirs = len(tile_dirs)
+    tile_ids = []
+    ra_min = np.empty(n_dirs, dtype=np.float64)
+    ra_max = np.empty(n_dirs, dtype=np.float64)
+    dec_min = np.empty(n_dirs, dtype=np.float64)
+    dec_max = np.empty(n_dirs, dtype=np.float64)
+    ra_center = np.empty(n_dirs, dtype=np.float64)
+    dec_center = np.empty(n_dirs, dtype=np.float64)
+    n_objects = np.empty(n_dirs, dtype=np.int64)
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(n_workers, n_dirs))) as executor:
+        scans = executor.map(lambda tile_dir: _scan_one_tile(*tile_dir, catalog_regex), tile_dirs)
+        
+        for scan in tqdm(scans, total=n_dirs, desc="扫描TILE"):
+            if scan is None:
                 continue
+            tile_id, ra, dec = scan
             
-            catalog_file = os.path.join(tile_path, catalog_files[0])
-            with fits.open(catalog_file) as hdul:
-                cat_table = Table(hdul[1].data)
-                
-                if 'RIGHT_ASCENSION' in cat_table.colnames and 'DECLINATION' in cat_table.colnames:
-                    ra_col, dec_col = 'RIGHT_ASCENSION', 'DECLINATION'
-                elif 'RA' in cat_table.colnames and 'DEC' in cat_table.colnames:
-                    ra_col, dec_col = 'RA', 'DEC'
-                else:
-                    continue
-                
-                tile_info_list.append({
-                    'TILE_ID': tile_id,
-                    'RA_MIN': float(np.min(cat_table[ra_col])),
-                    'RA_MAX': float(np.max(cat_table[ra_col])),
-                    'DEC_MIN': float(np.min(cat_table[dec_col])),
-                    'DEC_MAX': float(np.max(cat_table[dec_col])),
-                    'RA_CENTER': float(np.mean(cat_table[ra_col])),
-                    'DEC_CENTER': float(np.mean(cat_table[dec_col])),
-                    'N_OBJECTS': len(cat_table)
-                })
-                
-        except Exception as e:
-            print(f"处理TILE {tile_id} 时出错: {e}")
-            continue
+            i = len(tile_ids)
+            ra_min[i], ra_max[i] = np.min(ra), np.max(ra)
+            dec_min[i], dec_max[i] = np.min(dec), np.max(dec)
+            ra_center[i], dec_center[i] = np.mean(ra), np.mean(dec)
+            n_objects[i] = len(ra)
+            tile_ids.append(tile_id)
     
-    tile_index = Table(tile_info_list)
+    n = len(tile_ids)
+    tile_index = Table(
+        data=[np.array(tile_ids, dtype=str), ra_min[:n], ra_max[:n], dec_min[:n], dec_max[:n],
+              ra_center[:n], dec_center[:n], n_objects[:n]],
+        names=['TILE_ID', 'RA_MIN', 'RA_MAX', 'DEC_MIN', 'DEC_MAX',
+               'RA_CENTER', 'DEC_CENTER', 'N_OBJECTS']
+    )
     tile_index.write(output_file, format='fits', overwrite=True)
     print(f"索引已保存: {output_file}, 共 {len(tile_index)} 个TILE")
     return tile_index
 
 
+def _radec_to_xyz(ra, dec) -> np.ndarray:
+    """将赤经赤纬（度）转换为单位球面上的三维坐标，避免RA在0/360处的跳变"""
+    ra_rad = np.deg2rad(np.asarray(ra, dtype=np.float64))
+    dec_rad = np.deg2rad(np.asarray(dec, dtype=np.float64))
+    cos_dec = np.cos(dec_rad)
+    return np.stack((cos_dec * np.cos(ra_rad), cos_dec * np.sin(ra_rad), np.sin(dec_rad)), axis=-1)
+
+
+def _angsep(ra1: float, dec1: float, ra2: np.ndarray, dec2: np.ndarray) -> np.ndarray:
+    """单点到一组点的球面角距（度），haversine公式，不构造SkyCoord"""
+    ra1_rad, dec1_rad = np.deg2rad(ra1), np.deg2rad(dec1)
+    ra2_rad, dec2_rad = np.deg2rad(ra2), np.deg2rad(dec2)
+    hav = (np.sin((dec2_rad - dec1_rad) / 2) ** 2 +
+           np.cos(dec1_rad) * np.cos(dec2_rad) * np.sin((ra2_rad - ra1_rad) / 2) ** 2)
+    return np.rad2deg(2 * np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0))))
+
+
+def _chord_length(angle_deg: float) -> float:
+    """球面角距（度）对应的单位球弦长"""
+    return 2.0 * np.sin(np.deg2rad(min(angle_deg, 180.0)) / 2.0)
+
+
+def _load_tile_index(tile_index_file: str) -> Dict[str, object]:
+    """返回缓存的TILE索引（见_read_tile_index）
+
+    缓存键为文件的真实路径和修改时间：同一文件的不同写法共用一份索引，
+    索引文件被重新生成后自动重新读取。
+    """
+    path = os.path.realpath(tile_index_file)
+    return _read_tile_index(path, os.stat(path).st_mtime)
+
+
+def preload_tile_index(tile_index_file: str) -> int:
+    """预先加载TILE索引（如在worker启动时调用），返回TILE数量"""
+    return len(_load_tile_index(tile_index_file)['tile_ids'])
+
+
+@functools.lru_cache(maxsize=4)
+def _read_tile_index(tile_index_file: str, mtime: float) -> Dict[str, object]:
+    """读取TILE索引并缓存为连续的float64数组及TILE中心的KD树
+
+    每个进程只解析一次FITS索引，后续查询直接复用数组和KD树。
+    mtime只用作缓存键的一部分。
+
+    返回:
+        dict: {
+            'ra_min', 'ra_max', 'dec_min', 'dec_max',
+            'ra_center', 'dec_center': ndarray,
+            'tile_ids': ndarray,
+            'tree': cKDTree,       # TILE中心的单位向量
+            'max_radius': float    # 中心到边界框角点的最大角距（度）
+        }
+    """
+    # memmap读取，只有用到的几列会被复制为连续数组
+    tile_table = Table.read(tile_index_file, memmap=True)
+    index = {
+        key: np.ascontiguousarray(tile_table[key.upper()], dtype=np.float64)
+        for key in ('ra_min', 'ra_max', 'dec_min', 'dec_max', 'ra_center', 'dec_center')
+    }
+    index['tile_ids'] = np.asarray(tile_table['TILE_ID']).astype(str)
+
+    center_xyz = _radec_to_xyz(index['ra_center'], index['dec_center'])
+    index['tree'] = cKDTree(center_xyz)
+
+    # 候选半径取中心到四个角点的最大角距，保证球查询结果覆盖所有边界框命中
+    max_radius = 0.0
+    for ra_col in ('ra_min', 'ra_max'):
+        for dec_col in ('dec_min', 'dec_max'):
+            corner_xyz = _radec_to_xyz(index[ra_col], index[dec_col])
+            cos_sep = np.clip(np.einsum('ij,ij->i', center_xyz, corner_xyz), -1.0, 1.0)
+            if len(cos_sep):
+                max_radius = max(max_radius, float(np.rad2deg(np.arccos(cos_sep.min()))))
+    index['max_radius'] = max_radius
+    return index
+
+
 def query_tile_id(ra: float, dec: float, tile_index_file: str, 
                   tolerance: float = 0.01) -> Optional[str]:
     """根据坐标查询TILE ID"""
     try:
-        tile_table = Table.read(tile_index_file)
-        mask = (
-            (tile_table['RA_MIN'] - tolerance <= ra) &
-            (ra <= tile_table['RA_MAX'] + tolerance) &
-            (tile_table['DEC_MIN'] - tolerance <= dec) &
-            (dec <= tile_table['DEC_MAX'] + tolerance)
+        index = _load_tile_index(tile_index_file)
+
+        # KD树粗筛候选TILE，再对少量候选做精确的边界框判断
+        search_radius = _chord_length(index['max_radius'] + 2 * tolerance)
+        candidates = np.asarray(
+            index['tree'].query_ball_point(_radec_to_xyz(ra, dec), r=search_radius),
+            dtype=np.intp
         )
+        mask = np.logical_and.reduce((
+            index['ra_min'][candidates] - tolerance <= ra,
+            ra <= index['ra_max'][candidates] + tolerance,
+            index['dec_min'][candidates] - tolerance <= dec,
+            dec <= index['dec_max'][candidates] + tolerance
+        ))
         
-        matched_tiles = tile_table[mask]
+        matched = np.sort(candidates[mask])
+        tile_ids = index['tile_ids']
         
-        if len(matched_tiles) == 0:
+        if len(matched) == 0:
             return None
-        elif len(matched_tiles) == 1:
-            return str(matched_tiles['TILE_ID'][0])
+        elif len(matched) == 1:
+            return str(tile_ids[matched[0]])
         else:
-            coord = SkyCoord(ra, dec, unit='deg')
-            tile_centers = SkyCoord(matched_tiles['RA_CENTER'],
-                                   matched_tiles['DEC_CENTER'], unit='deg')
-            separations = coord.separation(tile_centers)
-            nearest_idx = np.argmin(separations)
-            return str(matched_tiles['TILE_ID'][nearest_idx])
+            # 多个TILE重叠时取中心最近的一个
+            separations = _angsep(ra, dec, index['ra_center'][matched], index['dec_center'][matched])
+            nearest_idx = matched[np.argmin(separations)]
+            return str(tile_ids[nearest_idx])
             
     except Exception as e:
         print(f"查询TILE ID时出错: {e}")
         return None
 
 
+def query_tile_ids(ra: np.ndarray, dec: np.ndarray, tile_index_file: str,
+                   tolerance: float = 0.01, chunk_size: int = 100000) -> List[Optional[str]]:
+    """
+    批量查询坐标对应的TILE ID，结果与逐个调用query_tile_id一致
+
+    KD树球查询和边界框判断都按数组进行，多个TILE重叠时同样取中心最近的一个。
+    坐标分块处理以限制候选列表占用的内存。
+
+    返回:
+        list: 每个坐标一个TILE ID，无法匹配时为None
+    """
+    ra = np.ascontiguousarray(ra, dtype=np.float64)
+    dec = np.ascontiguousarray(dec, dtype=np.float64)
+    results = [None] * len(ra)
+
+    try:
+        index = _load_tile_index(tile_index_file)
+        tile_ids = index['tile_ids']
+        search_radius = _chord_length(index['max_radius'] + 2 * tolerance)
+
+        for start in range(0, len(ra), chunk_size):
+            ra_chunk = ra[start:start + chunk_size]
+            dec_chunk = dec[start:start + chunk_size]
+            valid = np.flatnonzero(np.isfinite(ra_chunk) & np.isfinite(dec_chunk))
+            if len(valid) == 0:
+                continue
+
+            # 展开为(源, 候选TILE)对，再统一做精确的边界框判断
+            candidate_lists = index['tree'].query_ball_point(
+                _radec_to_xyz(ra_chunk[valid], dec_chunk[valid]), r=search_radius)
+            counts = np.fromiter(map(len, candidate_lists), dtype=np.intp, count=len(valid))
+            if counts.sum() == 0:
+                continue
+            candidates = np.concatenate([c for c in candidate_lists if c]).astype(np.intp)
+            sources = np.repeat(valid, counts)
+
+            src_ra, src_dec = ra_chunk[sources], dec_chunk[sources]
+            mask = np.logical_and.reduce((
+                index['ra_min'][candidates] - tolerance <= src_ra,
+                src_ra <= index['ra_max'][candidates] + tolerance,
+                index['dec_min'][candidates] - tolerance <= src_dec,
+                src_dec <= index['dec_max'][candidates] + tolerance
+            ))
+            sources, candidates = sources[mask], candidates[mask]
+            if len(sources) == 0:
+                continue
+
+            # 每个源取中心最近的TILE，距离相同时取索引较小者（与query_tile_id一致）
+            ra1, dec1 = np.deg2rad(ra_chunk[sources]), np.deg2rad(dec_chunk[sources])
+            ra2 = np.deg2rad(index['ra_center'][candidates])
+            dec2 = np.deg2rad(index['dec_center'][candidates])
+            hav = (np.sin((dec2 - dec1) / 2) ** 2 +
+                   np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2)
+            separations = np.rad2deg(2 * np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0))))
+
+            order = np.lexsort((candidates, separations, sources))
+            sources, candidates = sources[order], candidates[order]
+            first = np.ones(len(sources), dtype=bool)
+            first[1:] = sources[1:] != sources[:-1]
+            for src, tile_idx in zip(sources[first].tolist(), candidates[first].tolist()):
+                results[start + src] = str(tile_ids[tile_idx])
+
+    except Exception as e:
+        print(f"查询TILE ID时出错: {e}")
+        return [None] * len(ra)
+
+    return results
+
+
 def _get_file_pattern(file_type: str) -> str:
     """获取文件名匹配模式
 
@@ -177,40 +409,66 @@ def _get_instrument_prefix_map() -> Dict[str, str]:
     }
 
 
+@functools.lru_cache(maxsize=None)
+def _get_parse_regex(file_type: str) -> re.Pattern:
+    """获取从文件名（_TILE之前的部分）中提取inst_band的预编译正则"""
+    # WHT映射到FLAG，需要使用FLAG的解析逻辑
+    actual_file_type = 'FLAG' if file_type == 'WHT' else file_type
+
+    if actual_file_type in ['FLAG', 'RMS']:
+        # 最后一个EUC_MER_MOSAIC-之后、第一个-FLAG/-RMS之前的部分
+        return re.compile(r'^(?:.*EUC_MER_MOSAIC-)?(?P<inst_band>.*?)(?:-'
+                          + re.escape(actual_file_type) + r'.*)?$', re.DOTALL)
+    pattern = _get_file_pattern(file_type)
+    return re.compile(r'^(?:.*EUC_MER_' + re.escape(pattern) + r'-)?(?P<inst_band>.*)$', re.DOTALL)
+
+
+@functools.lru_cache(maxsize=100000)
 def _parse_filename(filename: str, file_type: str) -> Optional[Tuple[str, str]]:
     """
     从文件名解析仪器和波段
 
+    同一TILE的文件名在不同文件类型、过滤条件的查找中反复出现，结果按文件名缓存。
+
     返回: (instrument, band) 或 None
     """
     try:
-        notile = filename.split("_TILE")[0]
+        notile = filename.partition("_TILE")[0]
+        inst_band = _get_parse_regex(file_type).match(notile).group('inst_band')
 
-        # WHT映射到FLAG，需要使用FLAG的解析逻辑
-        actual_file_type = file_type
-        if file_type == 'WHT':
-            actual_file_type = 'FLAG'
-
-        if actual_file_type in ['FLAG', 'RMS']:
-            inst_band = notile.split("EUC_MER_MOSAIC-")[-1].split(f"-{actual_file_type}")[0]
-        else:
-            pattern = _get_file_pattern(file_type)
-            inst_band = notile.split(f"EUC_MER_{pattern}-")[-1]
-
-        parts = inst_band.split('-')
-        if len(parts) == 1:
+        instrument, sep, band = inst_band.partition('-')
+        if not sep:
             # 单通道仪器，如VIS
-            return parts[0], parts[0]
-        else:
-            # 多波段仪器，如DES-G, NIR-Y
-            instrument = parts[0]
-            band = '-'.join(parts[1:])
-            return instrument, band
+            return instrument, instrument
+        # 多波段仪器，如DES-G, NIR-Y
+        return instrument, band
 
     except Exception:
         return None
 
 
+@functools.lru_cache(maxsize=None)
+def _get_file_regex(file_type: str) -> re.Pattern:
+    """获取文件类型对应的预编译文件名正则
+
+    匹配包含 EUC_MER_{pattern} 的FITS文件，排除目录文件（FINAL-CAT），
+    并按file_type做更精确的过滤：
+    WHT/FLAG -> 包含-FLAG，RMS -> 包含-RMS，SCI/BGSUB -> 包含BGSUB
+    """
+    required = {
+        'WHT': '-FLAG',
+        'FLAG': '-FLAG',
+        'RMS': '-RMS',
+        'SCI': 'BGSUB',
+        'BGSUB': 'BGSUB',
+    }.get(file_type)
+    regex = r'^(?!.*FINAL-CAT)'
+    if required is not None:
+        regex += rf'(?=.*{re.escape(required)})'
+    regex += rf'.*{re.escape("EUC_MER_" + _get_file_pattern(file_type))}.*\.fits$'
+    return re.compile(regex)
+
+
 def find_files(tile_id: str, file_type: str, mer_root: str,
                instruments: Optional[List[str]] = None, bands: Optional[List[str]] = None) -> Dict:
     """
@@ -227,57 +485,52 @@ def find_files(tile_id: str, file_type: str, mer_root: str,
         dict: {'{instrument}_{band}': filepath}
         注意：返回的key使用目录名作为instrument
     """
-    mer_dir = os.path.join(mer_root, str(tile_id))
-    if not os.path.exists(mer_dir):
-        return {}
-    
-    pattern = _get_file_pattern(file_type)
-    instrument_prefix_map = _get_instrument_prefix_map()
+    return _match_tile_files(_scan_tile_dir(os.path.join(mer_root, str(tile_id))),
+                             file_type, instruments, bands)
+
+
+def _scan_tile_dir(mer_dir: str) -> Tuple[Tuple[str, str, Tuple[str, ...]], ...]:
+    """扫描一次TILE目录，列出各仪器目录下的FITS文件名
+
+    结果不跨调用缓存：服务进程长期运行，数据目录可能随时补充或替换文件。
+    同一次调用内需要多种文件类型时（见find_tile_files），扫描结果复用。
+
+    返回:
+        tuple: ((instrument_dir, inst_path, fits_files), ...)，目录不存在时为空
+    """
+    entries = []
+    try:
+        tile_entries = os.scandir(mer_dir)
+    except (FileNotFoundError, NotADirectoryError):
+        return ()
+    with tile_entries:
+        for inst_entry in tile_entries:
+            if not inst_entry.is_dir():
+                continue
+            with os.scandir(inst_entry.path) as file_entries:
+                fits_files = tuple(e.name for e in file_entries if e.name.endswith('.fits'))
+            entries.append((inst_entry.name, inst_entry.path, fits_files))
+    return tuple(entries)
+
+
+def _match_tile_files(tile_scan: Tuple[Tuple[str, str, Tuple[str, ...]], ...], file_type: str,
+                      instruments: Optional[List[str]] = None,
+                      bands: Optional[List[str]] = None) -> Dict:
+    """从_scan_tile_dir的扫描结果中筛选指定文件类型的文件，返回值同find_files"""
+    file_regex = _get_file_regex(file_type)
     found_files = {}
+    # 循环内的成员判断改用哈希集合
+    if instruments is not None:
+        instruments = frozenset(instruments)
+    if bands is not None:
+        bands = frozenset(bands)
     
-    for instrument_dir in os.listdir(mer_dir):
-        inst_path = os.path.join(mer_dir, instrument_dir)
-        if not os.path.isdir(inst_path):
-            continue
-        
+    for instrument_dir, inst_path, inst_fits_files in tile_scan:
         # 如果指定了仪器过滤，检查目录名
         if instruments is not None and instrument_dir not in instruments:
             continue
         
-        search_pattern = f'EUC_MER_{pattern}'
-        fits_files = [f for f in os.listdir(inst_path)
-                     if search_pattern in f and f.endswith('.fits')]
-
-        # 过滤掉目录文件（如FINAL-CAT文件）
-        filtered_files = []
-        for fits_file in fits_files:
-            # 跳过目录文件，这些文件不应该被当作图像文件处理
-            if 'FINAL-CAT' in fits_file:
-                continue
-
-            # 根据file_type进行更精确的过滤
-            # WHT -> FLAG文件（包含-FLAG）
-            # RMS -> RMS文件（包含-RMS）
-            # SCI -> BGSUB文件（包含BGSUB）
-            if file_type == 'WHT':
-                if '-FLAG' not in fits_file:
-                    continue
-            elif file_type == 'RMS':
-                if '-RMS' not in fits_file:
-                    continue
-            elif file_type == 'SCI':
-                if 'BGSUB' not in fits_file:
-                    continue
-            elif file_type == 'FLAG':
-                if '-FLAG' not in fits_file:
-                    continue
-            elif file_type == 'BGSUB':
-                if 'BGSUB' not in fits_file:
-                    continue
-
-            filtered_files.append(fits_file)
-
-        fits_files = filtered_files
+        fits_files = [f for f in inst_fits_files if file_regex.match(f)]
         
         for fits_file in fits_files:
             parsed = _parse_filename(fits_file, file_type)
@@ -285,18 +538,16 @@ def find_files(tile_id: str, file_type: str, mer_root: str,
                 continue
                 
             file_instrument, file_band = parsed
+            # 完整的波段标识（前缀-波段），如NIR-Y、DES-G；单通道仪器为VIS
+            full_band = f"{file_instrument}-{file_band}" if file_instrument != file_band else file_band
             
             # 如果指定了波段过滤，检查文件名中的完整波段标识
             # 例如：bands=['NIR-Y', 'DES-G']
-            if bands is not None:
-                # 构建完整的波段标识（前缀-波段）
-                full_band = f"{file_instrument}-{file_band}" if file_instrument != file_band else file_band
-                if full_band not in bands:
-                    continue
+            if bands is not None and full_band not in bands:
+                continue
             
             # 使用目录名作为instrument，保持一致性
-            key = f"{instrument_dir}_{file_instrument}-{file_band}" if file_instrument != file_band else f"{instrument_dir}_{file_band}"
-            found_files[key] = os.path.join(inst_path, fits_file)
+            found_files[f"{instrument_dir}_{full_band}"] = os.path.join(inst_path, fits_file)
     
     return found_files
 
@@ -305,6 +556,352 @@ def find_files(tile_id: str, file_type: str, mer_root: str,
 # 裁剪核心函数
 # ============================================================================
 
+def _empty_cutout_result() -> Dict:
+    """单个裁剪结果的初始结构"""
+    return {
+        'success': False,
+        'data': None,
+        'wcs': None,
+        'header': None,
+        'error': None,
+        'contains_nan': False
+    }
+
+
+def _contains_nan(data: np.ndarray) -> bool:
+    """判断裁剪结果是否包含NaN
+
+    整数图像（如FLAG）不可能包含NaN，直接返回；浮点图像先检查四条边，
+    超出拼接图边界或覆盖空白区的裁剪通常在边上就有NaN，可提前返回，
+    否则再扫描整个数组。
+    """
+    if data.dtype.kind not in 'fc':
+        return False
+    if data.ndim == 2 and data.size > 0:
+        if (np.isnan(data[0]).any() or np.isnan(data[-1]).any() or
+                np.isnan(data[:, 0]).any() or np.isnan(data[:, -1]).any()):
+            return True
+    return bool(np.isnan(data).any())
+
+
+def _cutout_shape(size: Union[int, Tuple]) -> Tuple[int, int]:
+    """将裁剪尺寸转换为(height, width)整数像素形状，与Cutout2D的取整方式一致"""
+    if np.isscalar(size):
+        size = (size, size)
+    if len(size) != 2:
+        raise ValueError("size must have at most two elements")
+    return int(np.round(size[0])), int(np.round(size[1]))
+
+
+def _fixed_size_origins(img_shape: Tuple[int, int], sizes: List[Union[int, Tuple]],
+                        xs: np.ndarray, ys: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    所有源裁剪尺寸相同时，向量化计算每个窗口的原点
+
+    原点取法与overlap_slices一致（ceil(中心 - 尺寸/2)）。
+
+    返回:
+        (x0, y0, inside) 或 None（尺寸不一致或无法解析）；
+        inside标记窗口完全落在图像内的源，其余源仍需走overlap_slices
+    """
+    try:
+        shapes = {_cutout_shape(size) for size in sizes}
+    except Exception:
+        return None
+    if len(shapes) != 1:
+        return None
+    (height, width), = shapes
+    if height <= 0 or width <= 0:
+        return None
+
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    finite = np.isfinite(xs) & np.isfinite(ys)
+    x0 = np.ceil(np.where(finite, xs, 0) - width / 2.0).astype(np.int64)
+    y0 = np.ceil(np.where(finite, ys, 0) - height / 2.0).astype(np.int64)
+    inside = (finite & (x0 >= 0) & (y0 >= 0)
+              & (x0 + width <= img_shape[1]) & (y0 + height <= img_shape[0]))
+    return x0, y0, inside
+
+
+def _shift_wcs(wcs: WCS, origin: Tuple[int, int], shape: Tuple[int, int]) -> WCS:
+    """复制WCS并将参考像素平移到裁剪区域原点(x0, y0)"""
+    cutout_wcs = copy.deepcopy(wcs)
+    cutout_wcs.wcs.crpix -= origin
+    cutout_wcs.array_shape = shape
+    if wcs.sip is not None:
+        cutout_wcs.sip = Sip(wcs.sip.a, wcs.sip.b, wcs.sip.ap, wcs.sip.bp,
+                             wcs.sip.crpix - origin)
+    return cutout_wcs
+
+
+def _prefer_full_read(rows_needed: Optional[int], shape: Tuple[int, ...]) -> bool:
+    """逐窗口读取的总行数超过图像行数两倍时，整幅读取一次更省"""
+    return rows_needed is not None and len(shape) > 0 and rows_needed > 2 * shape[0]
+
+
+def _is_remote_path(path: str) -> bool:
+    """是否为需要经fsspec访问的URI（s3://、https://等）"""
+    return '://' in str(path)
+
+
+def _fsspec_kwargs(path: str) -> Dict:
+    """远程读取的fsspec参数：1MB块（按窗口的range请求），S3匿名访问公开数据"""
+    kwargs = {'default_block_size': 1_000_000}
+    if str(path).startswith('s3://'):
+        kwargs['anon'] = True
+    return kwargs
+
+
+@contextlib.contextmanager
+def _open_image_hdu(fits_path: str, hdu_index: int = 0, rows_needed: Optional[int] = None):
+    """
+    打开图像HDU用于窗口读取
+
+    安装了fitsio时通过cfitsio只读取所需的行；否则使用astropy：未缩放的普通图像
+    直接对memmap切片，压缩或带BSCALE/BZERO的图像使用section，只解压/缩放与窗口
+    重叠的部分（这类图像访问.data会处理整幅图像）。
+
+    rows_needed为所有窗口行数之和。压缩或缩放的图像若逐窗口读取的总行数
+    超过整幅图像的两倍（多数行会被重复解压），则一次性读入整幅图像，
+    之后各窗口直接切片。
+
+    fits_path为远程URI（如s3://）时通过fsspec打开并按section读取，
+    每个读取线程使用自己的句柄，多个窗口的range请求可并发进行。
+
+    返回（上下文管理器）:
+        (header, shape, read_window): header为astropy Header，shape为(ny, nx)，
+        read_window(slices)返回对应窗口的ndarray拷贝，可在多个线程中调用
+    """
+    if _is_remote_path(fits_path):
+        local = threading.local()
+        handles = []
+
+        def get_hdu():
+            hdul = getattr(local, 'hdul', None)
+            if hdul is None:
+                hdul = local.hdul = fits.open(fits_path, use_fsspec=True, lazy_load_hdus=True,
+                                              fsspec_kwargs=_fsspec_kwargs(fits_path))
+                handles.append(hdul)
+            return hdul[hdu_index]
+
+        try:
+            hdu = get_hdu()
+            yield hdu.header, hdu.shape, lambda slices: np.array(get_hdu().section[slices])
+        finally:
+            for hdul in handles:
+                hdul.close()
+    elif fitsio is not None:
+        header = fits.getheader(fits_path, hdu_index)
+        # cfitsio的文件句柄不能跨线程共享：每个读取线程打开自己的句柄，
+        # 窗口读取（含压缩tile的解压）在C层进行，各线程可并行
+        local = threading.local()
+        handles = [fitsio.FITS(fits_path)]
+        local.fits_file = handles[0]
+        shape = tuple(handles[0][hdu_index].get_dims())
+
+        if handles[0][hdu_index].is_compressed() and _prefer_full_read(rows_needed, shape):
+            try:
+                img_data = handles[0][hdu_index].read()
+            finally:
+                handles[0].close()
+            yield header, img_data.shape, lambda slices: np.array(img_data[slices])
+            return
+
+        def read_window(slices):
+            fits_file = getattr(local, 'fits_file', None)
+            if fits_file is None:
+                fits_file = local.fits_file = fitsio.FITS(fits_path)
+                handles.append(fits_file)
+            return fits_file[hdu_index][slices]
+
+        try:
+            yield header, shape, read_window
+        finally:
+            for fits_file in handles:
+                fits_file.close()
+    else:
+        with fits.open(fits_path, memmap=True, lazy_load_hdus=True) as hdul:
+            hdu = hdul[hdu_index]
+            header = hdu.header
+            scaled = header.get('BSCALE', 1) != 1 or header.get('BZERO', 0) != 0
+            if not isinstance(hdu, fits.CompImageHDU) and not scaled:
+                img_data = hdu.data
+                yield header, img_data.shape, lambda slices: np.array(img_data[slices])
+                return
+
+        # 压缩图像的.data会解压整幅图像，缩放图像不能memmap：
+        # 改为通过文件句柄读取section，读取需串行
+        with fits.open(fits_path, memmap=False, lazy_load_hdus=True) as hdul:
+            hdu = hdul[hdu_index]
+            if _prefer_full_read(rows_needed, hdu.shape):
+                img_data = hdu.data
+                yield hdu.header, img_data.shape, lambda slices: np.array(img_data[slices])
+                return
+            section = hdu.section
+            lock = threading.Lock()
+
+            def read_window(slices):
+                with lock:
+                    return np.array(section[slices])
+
+            yield hdu.header, hdu.shape, read_window
+
+
+def _read_psf_catalog(psf_fits_path: str) -> Tuple[int, Tuple[int, ...], Table]:
+    """读取PSF文件的STMPSIZE、图像（HDU 1）尺寸和PSF表（HDU 2），不读取图像数据"""
+    if fitsio is not None:
+        with fitsio.FITS(psf_fits_path) as fits_file:
+            stmpsize = fits_file[1].read_header().get('STMPSIZE', 0)
+            shape = tuple(fits_file[1].get_dims())
+            psf_table = Table(fits_file[2].read())
+    else:
+        # 表数据直接读入内存，不保留memmap及其文件句柄
+        with fits.open(psf_fits_path, memmap=False, lazy_load_hdus=True) as hdul:
+            stmpsize = hdul[1].header.get('STMPSIZE', 0)
+            shape = tuple(hdul[1].shape)
+            psf_table = Table(hdul[2].data)
+    return stmpsize, shape, psf_table
+
+
+def _load_psf_catalog(psf_fits_path: str) -> Tuple[int, Tuple[int, ...], Table, cKDTree]:
+    """返回缓存的PSF表及KD树（见_read_psf_index）
+
+    与TILE索引相同，缓存键为文件的真实路径和修改时间，PSF文件被替换后自动重新读取。
+    """
+    path = os.path.realpath(psf_fits_path)
+    return _read_psf_index(path, os.stat(path).st_mtime)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_psf_index(psf_fits_path: str, mtime: float) -> Tuple[int, Tuple[int, ...], Table, cKDTree]:
+    """读取PSF表并构建PSF位置（单位向量）的KD树
+
+    只缓存表和KD树，PSF图像（整幅拼接图）不常驻内存，裁剪时按需读取所需的小图。
+    mtime只用作缓存键的一部分。
+
+    返回:
+        tuple: (stmpsize, image_shape, psf_table, tree)
+    """
+    stmpsize, shape, psf_table = _read_psf_catalog(psf_fits_path)
+    tree = cKDTree(_radec_to_xyz(psf_table['RA'], psf_table['Dec']))
+    return stmpsize, shape, psf_table, tree
+
+
+def _read_cutout_window(read_window, plan: Tuple, fill_value: float):
+    """读取一个裁剪窗口，需要时按partial模式填充；出错时返回异常对象"""
+    shape, slices_large, slices_small = plan[:3]
+    try:
+        window = read_window(slices_large)
+        if slices_small is not None and window.shape != shape:
+            data = np.full(shape, fill_value, dtype=window.dtype)
+            data[slices_small] = window
+            return data
+        return window
+    except Exception as e:
+        return e
+
+
+def _cutout_image_batch(fits_path: str, ra: List[float], dec: List[float],
+                        sizes: List[Union[int, Tuple]], hdu_index: int = 0,
+                        mode: str = 'partial', fill_value: float = 0,
+                        n_threads: int = 1) -> List[Dict]:
+    """
+    对同一FITS图像批量裁剪多个坐标
+
+    文件以memmap方式只打开一次、WCS只构建一次；每个源直接对图像数组切片，
+    只读入裁剪窗口对应的页面，不经过Cutout2D。结果顺序与输入坐标一致。
+    n_threads > 1时用线程池并行读取各窗口（numpy拷贝和页面读取期间释放GIL）。
+
+    返回:
+        list: 每个坐标一个与cutout_image相同结构的dict
+    """
+    results = [_empty_cutout_result() for _ in ra]
+    
+    # 所有窗口的总行数，用于判断压缩图像是否整幅解压一次更省（见_open_image_hdu）
+    try:
+        rows_needed = sum(_cutout_shape(size)[0] for size in sizes)
+    except Exception:
+        rows_needed = None
+    
+    try:
+        with _open_image_hdu(fits_path, hdu_index, rows_needed) as (img_header, img_shape, read_window):
+            wcs = WCS(img_header)
+            base_header = wcs.to_header()
+            
+            # 所有源的像素坐标一次性转换，分摊畸变迭代求解的开销；
+            # 批量求解失败（如个别源不收敛）时退回逐个转换
+            try:
+                xs, ys = wcs.all_world2pix(np.asarray(ra, dtype=np.float64),
+                                           np.asarray(dec, dtype=np.float64), 0)
+            except Exception:
+                xs = ys = None
+            
+            # 整批使用同一尺寸时（最常见的情况），一次性算出所有窗口原点，
+            # 完全落在图像内的源直接切片，不再逐个经过overlap_slices
+            fixed_origins = None
+            if xs is not None:
+                fixed_origins = _fixed_size_origins(img_shape, sizes, xs, ys)
+            
+            # 先确定每个源的读取窗口：(shape, slices_large, slices_small, origin)，
+            # slices_small为None表示窗口无需填充
+            plans = [None] * len(results)
+            for i, result in enumerate(results):
+                try:
+                    shape = _cutout_shape(sizes[i])
+                    if fixed_origins is not None and fixed_origins[2][i]:
+                        x0, y0 = int(fixed_origins[0][i]), int(fixed_origins[1][i])
+                        plans[i] = (shape, (slice(y0, y0 + shape[0]), slice(x0, x0 + shape[1])),
+                                    None, (x0, y0))
+                    else:
+                        if xs is not None:
+                            x, y = xs[i], ys[i]
+                        else:
+                            x, y = wcs.all_world2pix(ra[i], dec[i], 0)
+                        slices_large, slices_small = overlap_slices(
+                            img_shape, shape, (float(y), float(x)), mode=mode)
+                        # 裁剪数组第一个像素在原图中的位置（含填充部分）
+                        origin = (slices_large[1].start - slices_small[1].start,
+                                  slices_large[0].start - slices_small[0].start)
+                        plans[i] = (shape, slices_large,
+                                    slices_small if mode == 'partial' else None, origin)
+                except Exception as e:
+                    result['error'] = str(e)
+            
+            todo = [i for i, plan in enumerate(plans) if plan is not None]
+            read_one = lambda i: _read_cutout_window(read_window, plans[i], fill_value)
+            if n_threads > 1 and len(todo) > 1:
+                with ThreadPoolExecutor(max_workers=min(n_threads, len(todo))) as executor:
+                    windows = list(executor.map(read_one, todo))
+            else:
+                windows = [read_one(i) for i in todo]
+            
+            for i, data in zip(todo, windows):
+                result = results[i]
+                if isinstance(data, Exception):
+                    result['error'] = str(data)
+                    continue
+                try:
+                    origin = plans[i][3]
+                    header = base_header.copy()
+                    header['CRPIX1'] = base_header['CRPIX1'] - origin[0]
+                    header['CRPIX2'] = base_header['CRPIX2'] - origin[1]
+                    
+                    result['success'] = True
+                    result['data'] = data
+                    result['wcs'] = _shift_wcs(wcs, origin, data.shape)
+                    result['header'] = header
+                    result['contains_nan'] = _contains_nan(data)
+                except Exception as e:
+                    result['error'] = str(e)
+            
+    except Exception as e:
+        for result in results:
+            result['error'] = str(e)
+    
+    return results
+
+
 def cutout_image(fits_path: str, ra: float, dec: float, size: Union[int, Tuple],
                  hdu_index: int = 0, mode: str = 'partial',
                  fill_value: float = 0) -> Dict:
@@ -327,35 +924,96 @@ def cutout_image(fits_path: str, ra: float, dec: float, size: Union[int, Tuple],
             'contains_nan': bool
         }
     """
-    result = {
-        'success': False,
-        'data': None,
-        'wcs': None,
-        'header': None,
-        'error': None,
-        'contains_nan': False
-    }
+    return _cutout_image_batch(fits_path, [ra], [dec], [size], hdu_index=hdu_index,
+                               mode=mode, fill_value=fill_value)[0]
+
+
+def _cutout_psf_batch(psf_fits_path: str, ra: List[float], dec: List[float]) -> List[Dict]:
+    """
+    对同一PSF catalog批量查找多个坐标最近的PSF
+
+    PSF表及其KD树按路径缓存，所有源的最近邻一次查询完成，结果顺序与输入坐标一致；
+    PSF图像每批只打开一次，只读取用到的小图。
+
+    返回:
+        list: 每个坐标一个与cutout_image相同结构的dict
+    """
+    results = [_empty_cutout_result() for _ in ra]
     
     try:
-        with fits.open(fits_path) as hdul:
-            img_data = hdul[hdu_index].data
-            img_header = hdul[hdu_index].header
-            
-            wcs = WCS(img_header)
-            center = SkyCoord(ra, dec, unit='deg')
-            cutout = Cutout2D(img_data, center, size, wcs=wcs,
-                            mode=mode, fill_value=fill_value)
-            
-            result['success'] = True
-            result['data'] = cutout.data
-            result['wcs'] = cutout.wcs
-            result['header'] = cutout.wcs.to_header()
-            result['contains_nan'] = np.isnan(cutout.data).any()
+        stmpsize, img_shape, psf_table, tree = _load_psf_catalog(psf_fits_path)
+        
+        if stmpsize == 0:
+            for result in results:
+                result['error'] = "PSF文件中没有STMPSIZE信息"
+            return results
+        
+        # 单位向量空间中弦长最近即角距最近
+        _, nearest_indices = tree.query(_radec_to_xyz(ra, dec))
+        
+        # 先确定每个源的小图位置，再打开PSF图像一次，只读取这些小图
+        stamps = []
+        for i, result in enumerate(results):
+            try:
+                nearest_idx = nearest_indices[i]
+                nearest_psf = psf_table[nearest_idx]
+                
+                psf_center_x = nearest_psf['x_center']
+                psf_center_y = nearest_psf['y_center']
+                
+                half_size = stmpsize // 2
+                x_min = max(0, int(psf_center_x - half_size) - 1)
+                y_min = max(0, int(psf_center_y - half_size) - 1)
+                
+                if x_min + stmpsize > img_shape[1]:
+                    x_min = img_shape[1] - stmpsize
+                if y_min + stmpsize > img_shape[0]:
+                    y_min = img_shape[0] - stmpsize
+                
+                if x_min < 0 or y_min < 0:
+                    result['error'] = "PSF裁剪区域超出图像边界"
+                    continue
+                
+                stamps.append((result, nearest_idx, nearest_psf, x_min, y_min))
+            except Exception as e:
+                result['error'] = str(e)
+        
+        if not stamps:
+            return results
+        
+        with _open_image_hdu(psf_fits_path, 1, stmpsize * len(stamps)) as (_, _, read_window):
+            for result, nearest_idx, nearest_psf, x_min, y_min in stamps:
+                try:
+                    psf_cutout = read_window((slice(y_min, y_min + stmpsize),
+                                              slice(x_min, x_min + stmpsize)))
+                    
+                    if psf_cutout.size == 0:
+                        result['error'] = "PSF裁剪得到空数组"
+                        continue
+                    
+                    header = fits.Header()
+                    header['STMPSIZE'] = stmpsize
+                    header['PSF_RA'] = nearest_psf['RA']
+                    header['PSF_DEC'] = nearest_psf['Dec']
+                    if 'FWHM' in nearest_psf.colnames:
+                        header['PSF_FWHM'] = nearest_psf['FWHM']
+                    header['PSF_IDX'] = nearest_idx
+                    header['PSF_XCTR'] = nearest_psf['x_center']
+                    header['PSF_YCTR'] = nearest_psf['y_center']
+                    
+                    result['success'] = True
+                    result['data'] = psf_cutout
+                    result['wcs'] = None
+                    result['header'] = header
+                    result['contains_nan'] = _contains_nan(psf_cutout)
+                except Exception as e:
+                    result['error'] = str(e)
             
     except Exception as e:
-        result['error'] = str(e)
+        for result in results:
+            result['error'] = str(e)
     
-    return result
+    return results
 
 
 def cutout_psf(psf_fits_path: str, ra: float, dec: float) -> Dict:
@@ -365,74 +1023,85 @@ def cutout_psf(psf_fits_path: str, ra: float, dec: float) -> Dict:
     返回:
         dict: 与cutout_image相同的结构
     """
-    result = {
-        'success': False,
-        'data': None,
-        'wcs': None,
-        'header': None,
-        'error': None,
-        'contains_nan': False
-    }
+    return _cutout_psf_batch(psf_fits_path, [ra], [dec])[0]
+
+
+def cutout_tile_batch(tile_id: str, ra: List[float], dec: List[float],
+                      sizes: List[Union[int, Tuple]], file_type: str, mer_root: str,
+                      instruments: Optional[List[str]] = None, bands: Optional[List[str]] = None,
+                      skip_nan: bool = True, n_threads: int = 1,
+                      files: Optional[Dict] = None) -> List[Dict]:
+    """
+    对同一TILE中的多个源批量裁剪指定文件类型的所有匹配波段
+    
+    find_files只调用一次，每个波段文件只打开一次，再依次裁剪所有源。
+    
+    参数:
+        ra, dec: 源坐标列表
+        sizes: 每个源的裁剪尺寸，整数或(height, width)元组
+        file_type: 文件类型
+        skip_nan: 是否跳过包含NaN的结果
+        n_threads: 同一图像内并行读取裁剪窗口的线程数
+        files: 预先查找好的文件字典（find_files的返回值），提供时不再扫描目录
+        
+    返回:
+        list: 每个源一个与cutout_tile相同结构的dict，顺序与输入一致
+    """
+    results = [{'success': False, 'cutouts': {}, 'error': None} for _ in ra]
     
     try:
-        with fits.open(psf_fits_path) as hdul:
-            img_data = hdul[1].data
-            img_header = hdul[1].header
-            psf_table = Table(hdul[2].data)
-            stmpsize = img_header.get('STMPSIZE', 0)
-            
-            if stmpsize == 0:
-                result['error'] = "PSF文件中没有STMPSIZE信息"
-                return result
-            
-            target_coord = SkyCoord(ra, dec, unit='deg')
-            psf_coords = SkyCoord(psf_table['RA'], psf_table['Dec'], unit='deg')
-            separations = target_coord.separation(psf_coords)
-            nearest_idx = np.argmin(separations)
-            nearest_psf = psf_table[nearest_idx]
-            
-            psf_center_x = nearest_psf['x_center']
-            psf_center_y = nearest_psf['y_center']
-            
-            half_size = stmpsize // 2
-            x_min = max(0, int(psf_center_x - half_size) - 1)
-            y_min = max(0, int(psf_center_y - half_size) - 1)
-            
-            if x_min + stmpsize > img_data.shape[1]:
-                x_min = img_data.shape[1] - stmpsize
-            if y_min + stmpsize > img_data.shape[0]:
-                y_min = img_data.shape[0] - stmpsize
-            
-            if x_min < 0 or y_min < 0:
-                result['error'] = "PSF裁剪区域超出图像边界"
-                return result
-            
-            psf_cutout = img_data[y_min:y_min+stmpsize, x_min:x_min+stmpsize]
-            
-            if psf_cutout.size == 0:
-                result['error'] = "PSF裁剪得到空数组"
-                return result
-            
-            header = fits.Header()
-            header['STMPSIZE'] = stmpsize
-            header['PSF_RA'] = nearest_psf['RA']
-            header['PSF_DEC'] = nearest_psf['Dec']
-            if 'FWHM' in nearest_psf.colnames:
-                header['PSF_FWHM'] = nearest_psf['FWHM']
-            header['PSF_IDX'] = nearest_idx
-            header['PSF_XCTR'] = psf_center_x
-            header['PSF_YCTR'] = psf_center_y
+        if files is None:
+            files = find_files(tile_id, file_type, mer_root, instruments, bands)
+        
+        if not files:
+            for result in results:
+                result['error'] = f"未找到TILE {tile_id} 的 {file_type} 文件"
+            return results
+        
+        for key, filepath in files.items():
+            # 处理星表文件和其他文件类型不同的key格式
+            if file_type == 'CATALOG-PSF':
+                # 对于星表文件，key可能没有标准的仪器-波段格式
+                # 尝试解析，如果失败则使用默认值
+                try:
+                    instrument, band = key.split('_', 1)
+                except ValueError:
+                    # 如果无法解析，使用默认的仪器和波段标识
+                    instrument = 'CATALOG'
+                    band = 'PSF'
+            else:
+                # 对于图像文件，标准格式是{instrument}_{band}
+                try:
+                    instrument, band = key.split('_', 1)
+                except ValueError:
+                    print(f"警告: 无法解析文件key {key} 的仪器和波段信息")
+                    continue
             
-            result['success'] = True
-            result['data'] = psf_cutout
-            result['wcs'] = None
-            result['header'] = header
-            result['contains_nan'] = np.isnan(psf_cutout).any()
+            if file_type == 'CATALOG-PSF':
+                cutout_results = _cutout_psf_batch(filepath, ra, dec)
+            else:
+                cutout_results = _cutout_image_batch(filepath, ra, dec, sizes, n_threads=n_threads)
             
+            for result, cutout_result in zip(results, cutout_results):
+                if cutout_result['success']:
+                    if cutout_result['contains_nan'] and skip_nan:
+                        continue
+                    
+                    cutout_result['instrument'] = instrument
+                    cutout_result['band'] = band
+                    result['cutouts'][key] = cutout_result
+        
+        for result in results:
+            if result['cutouts']:
+                result['success'] = True
+            else:
+                result['error'] = "所有波段裁剪都失败或包含NaN"
+        
     except Exception as e:
-        result['error'] = str(e)
+        for result in results:
+            result['error'] = str(e)
     
-    return result
+    return results
 
 
 def cutout_tile(tile_id: str, ra: float, dec: float, size: Union[int, Tuple],
@@ -454,65 +1123,217 @@ def cutout_tile(tile_id: str, ra: float, dec: float, size: Union[int, Tuple],
             'error': str
         }
     """
-    result = {
-        'success': False,
-        'cutouts': {},
-        'error': None
-    }
-    
+    return cutout_tile_batch(tile_id, [ra], [dec], [size], file_type, mer_root,
+                             instruments=instruments, bands=bands, skip_nan=skip_nan)[0]
+
+
+def find_tile_files(tile_ids: List, file_types: List[str], mer_root: str,
+                    instruments: Optional[List[str]] = None,
+                    bands: Optional[List[str]] = None,
+                    n_workers: int = 16) -> Dict[Tuple[str, str], Dict]:
+    """
+    为一批TILE预先查找所有文件类型的文件
+
+    在主进程中对每个TILE目录只扫描一次，结果随任务参数传给worker，
+    避免同一TILE被分到多个worker时各自重复扫描目录。各TILE目录的扫描
+    在线程池中并行进行（并行文件系统上目录操作以延迟为主）。
+
+    返回:
+        dict: {(tile_id, file_type): find_files的返回值}，空TILE_ID被跳过
+    """
+    def scan_tile(tile_id):
+        files = {}
+        try:
+            # 每个TILE目录只扫描一次，各文件类型共用扫描结果
+            tile_scan = _scan_tile_dir(os.path.join(mer_root, tile_id))
+        except Exception:
+            # 交给cutout_tile_batch按原逻辑查找并报告错误
+            return files
+        for file_type in file_types:
+            try:
+                files[(tile_id, file_type)] = _match_tile_files(
+                    tile_scan, file_type, instruments, bands)
+            except Exception:
+                continue
+        return files
+
+    unique_tile_ids = sorted({str(tile_id) for tile_id in tile_ids
+                              if tile_id is not None and tile_id != ''})
+    tile_files = {}
+    if not unique_tile_ids:
+        return tile_files
+    with ThreadPoolExecutor(max_workers=max(1, min(n_workers, len(unique_tile_ids)))) as executor:
+        for files in executor.map(scan_tile, unique_tile_ids):
+            tile_files.update(files)
+    return tile_files
+
+
+# ============================================================================
+# 保存函数
+# ============================================================================
+
+def _zarr_array_path(output_dir: str, file_type: str, key: str) -> str:
+    """zarr输出中某文件类型、某波段的数组路径"""
+    return os.path.join(output_dir, f"{file_type}.zarr", key)
+
+
+
+
+def _create_zarr_arrays(output_dir: str, file_types: List[str], tile_files: Dict,
+                        n_sources: int, shape: Tuple[int, int]) -> None:
+    """
+    在主进程中为每个(文件类型, 波段)预先创建(N, H, W)的zarr数组
+
+    每个源单独一个chunk，worker按行号并发写入不同chunk互不冲突；
+    未写入的源保持NaN填充值。
+    """
+    for file_type in file_types:
+        keys = set()
+        for (_, tile_file_type), files in tile_files.items():
+            if tile_file_type == file_type:
+                keys.update(files)
+        for key in sorted(keys):
+            zarr.open_array(_zarr_array_path(output_dir, file_type, key), mode='w',
+                            shape=(n_sources,) + shape, chunks=(1,) + shape,
+                            dtype='f4', fill_value=np.nan)
+
+
+def _save_cutouts_zarr(output_dir: str, file_type: str, idx: int, cutouts_result: Dict,
+                       arrays: Optional[Dict] = None) -> bool:
+    """
+    将一个源的各波段裁剪写入zarr数组的第idx行
+
+    arrays为调用方持有的{路径: 已打开数组}字典，同一批源复用打开的数组，
+    不必每个源都读取一次元数据；数组每次运行都会重新创建，因此不做进程级缓存。
+    """
+    if arrays is None:
+        arrays = {}
+    try:
+        for key, cutout_info in cutouts_result['cutouts'].items():
+            path = _zarr_array_path(output_dir, file_type, key)
+            array = arrays.get(path)
+            if array is None:
+                array = arrays[path] = zarr.open_array(path, mode='r+')
+            array[idx] = cutout_info['data']
+        return True
+    except Exception as e:
+        logger.warning("写入zarr数组时出错: %s", e)
+        return False
+
+
+# 本进程已创建（或确认存在）的输出目录，避免每个文件都调用os.makedirs
+_created_dirs = set()
+
+
+def _ensure_dir(path: str) -> None:
+    """确保目录存在，已确认过的目录直接跳过"""
+    if path and path not in _created_dirs:
+        os.makedirs(path, exist_ok=True)
+        _created_dirs.add(path)
+
+
+def _write_file(output_path: str, data, overwrite: bool = True) -> None:
+    """将字节数据一次写入文件，必要时创建目录"""
+    output_dir = os.path.dirname(output_path)
+    _ensure_dir(output_dir)
+    mode = 'wb' if overwrite else 'xb'
+    try:
+        with open(output_path, mode) as f:
+            f.write(data)
+    except FileNotFoundError:
+        # 目录在缓存后被外部删除（如任务清理），重新创建后重试一次
+        _created_dirs.discard(output_dir)
+        _ensure_dir(output_dir)
+        with open(output_path, mode) as f:
+            f.write(data)
+
+
+@contextlib.contextmanager
+def _background_writer(maxsize: int = 32):
+    """
+    后台写文件线程
+
+    返回（上下文管理器）:
+        submit(output_path, data, overwrite=True)，把写入请求放入有界队列并返回Future；
+        队列满时阻塞，限制尚未写出的数据量。退出时等待所有请求写完
+    """
+    write_queue = queue.Queue(maxsize=maxsize)
+
+    def writer_loop():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            future, args = item
+            try:
+                _write_file(*args)
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+    thread = threading.Thread(target=writer_loop, daemon=True)
+    thread.start()
+
+    def submit(output_path, data, overwrite=True):
+        future = Future()
+        write_queue.put((future, (output_path, data, overwrite)))
+        return future
+
     try:
-        files = find_files(tile_id, file_type, mer_root, instruments, bands)
-        
-        if not files:
-            result['error'] = f"未找到TILE {tile_id} 的 {file_type} 文件"
-            return result
-        
-        for key, filepath in files.items():
-            # 处理星表文件和其他文件类型不同的key格式
-            if file_type == 'CATALOG-PSF':
-                # 对于星表文件，key可能没有标准的仪器-波段格式
-                # 尝试解析，如果失败则使用默认值
-                try:
-                    instrument, band = key.split('_', 1)
-                except ValueError:
-                    # 如果无法解析，使用默认的仪器和波段标识
-                    instrument = 'CATALOG'
-                    band = 'PSF'
-            else:
-                # 对于图像文件，标准格式是{instrument}_{band}
-                try:
-                    instrument, band = key.split('_', 1)
-                except ValueError:
-                    print(f"警告: 无法解析文件key {key} 的仪器和波段信息")
-                    continue
-            
-            if file_type == 'CATALOG-PSF':
-                cutout_result = cutout_psf(filepath, ra, dec)
-            else:
-                cutout_result = cutout_image(filepath, ra, dec, size)
+        yield submit
+    finally:
+        write_queue.put(None)
+        thread.join()
+
+
+def _serialize_cutouts(cutouts_result: Dict, obj_id: Optional[str] = None,
+                       catalog_row: Optional[Table.Row] = None) -> memoryview:
+    """将裁剪结果组装为多扩展FITS并序列化为字节（save_cutouts的写文件前半部分）"""
+    primary_hdu = fits.PrimaryHDU()
+    if obj_id is not None:
+        primary_hdu.header['OBJID'] = obj_id
+    
+    hdul = fits.HDUList([primary_hdu])
+    hdu_index = 1
+    
+    for key, cutout_info in cutouts_result['cutouts'].items():
+        wcs = cutout_info['wcs']
+        header = cutout_info['header']
+        if header is not None and (wcs is None or 'CRPIX1' in header):
+            # 图像裁剪返回的header已是平移参考像素后的WCS头，直接使用，
+            # 省去逐源wcs.to_header()的序列化；ImageHDU会复制header
+            cutout_header = header
+        else:
+            # 先合并WCS头和附加头，再一次性构建HDU，避免逐个关键字插入
+            cutout_header = fits.Header()
+            if wcs is not None:
+                cutout_header.update(wcs.to_header())
             
-            if cutout_result['success']:
-                if cutout_result['contains_nan'] and skip_nan:
-                    continue
-                
-                cutout_result['instrument'] = instrument
-                cutout_result['band'] = band
-                result['cutouts'][key] = cutout_result
+            if header is not None:
+                cutout_header.update({hkey: value for hkey, value in header.items()
+                                      if hkey not in cutout_header})
         
-        if result['cutouts']:
-            result['success'] = True
-        else:
-            result['error'] = "所有波段裁剪都失败或包含NaN"
+        cutout_hdu = fits.ImageHDU(data=cutout_info['data'], header=cutout_header)
+        cutout_hdu.header['INSTRUME'] = cutout_info['instrument']
+        cutout_hdu.header['BAND'] = cutout_info['band']
+        primary_hdu.header[f'HDU{hdu_index}'] = key
         
-    except Exception as e:
-        result['error'] = str(e)
+        hdul.append(cutout_hdu)
+        hdu_index += 1
     
-    return result
+    if catalog_row is not None:
+        # 直接切出该行所在的单行表，保留原列类型，不再逐列重建Table
+        row_index = catalog_row.index
+        source_table = catalog_row.table[row_index:row_index + 1]
+        table_hdu = fits.BinTableHDU(source_table)
+        hdul.append(table_hdu)
+        primary_hdu.header['SRCTABLE'] = len(hdul) - 1
 
+    # 先序列化到内存，再一次顺序写入文件，避免逐个HDU的小块写入和seek
+    buffer = io.BytesIO()
+    hdul.writeto(buffer, output_verify='ignore', checksum=False)
+    return buffer.getbuffer()
 
-# ============================================================================
-# 保存函数
-# ============================================================================
 
 def save_cutouts(output_path: str, cutouts_result: Dict, obj_id: Optional[str] = None,
                  catalog_row: Optional[Table.Row] = None, overwrite: bool = True,
@@ -533,44 +1354,7 @@ def save_cutouts(output_path: str, cutouts_result: Dict, obj_id: Optional[str] =
         if not cutouts_result['success']:
             return False
         
-        primary_hdu = fits.PrimaryHDU()
-        if obj_id is not None:
-            primary_hdu.header['OBJID'] = obj_id
-        
-        hdul = fits.HDUList([primary_hdu])
-        hdu_index = 1
-        
-        for key, cutout_info in cutouts_result['cutouts'].items():
-            cutout_hdu = fits.ImageHDU(data=cutout_info['data'])
-            
-            if cutout_info['wcs'] is not None:
-                cutout_header = cutout_info['wcs'].to_header()
-                for hkey in cutout_header:
-                    cutout_hdu.header[hkey] = cutout_header[hkey]
-            
-            if cutout_info['header'] is not None:
-                for hkey in cutout_info['header']:
-                    if hkey not in cutout_hdu.header:
-                        cutout_hdu.header[hkey] = cutout_info['header'][hkey]
-            
-            cutout_hdu.header['INSTRUME'] = cutout_info['instrument']
-            cutout_hdu.header['BAND'] = cutout_info['band']
-            primary_hdu.header[f'HDU{hdu_index}'] = key
-            
-            hdul.append(cutout_hdu)
-            hdu_index += 1
-        
-        if catalog_row is not None:
-            source_table = Table()
-            for col_name in catalog_row.colnames:
-                source_table[col_name] = [catalog_row[col_name]]
-            table_hdu = fits.BinTableHDU(source_table)
-            hdul.append(table_hdu)
-            primary_hdu.header['SRCTABLE'] = len(hdul) - 1
-        
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        hdul.writeto(output_path, overwrite=overwrite)
-        
+        _write_file(output_path, _serialize_cutouts(cutouts_result, obj_id, catalog_row), overwrite)
         return True
         
     except Exception as e:
@@ -583,134 +1367,230 @@ def save_cutouts(output_path: str, cutouts_result: Dict, obj_id: Optional[str] =
 # 批处理函数
 # ============================================================================
 
+def _legacy_file_type(file_type):
+    """process_catalog_by_tile中的'PSF'对应PSF星表文件"""
+    return 'CATALOG-PSF' if file_type == 'PSF' else file_type
+
+
+def _cutout_targets(tile_id, ras, decs, target_ids, output_dir, config):
+    """
+    对同一TILE中的一组目标批量裁剪，每个目标保存一个多扩展FITS文件
+
+    每种文件类型只调用一次cutout_tile_batch：每个波段文件只打开一次，
+    所有目标的像素坐标一次性转换，再逐个切片。所有文件类型和波段的裁剪
+    作为图像扩展写入同一个{target_id}.fits，扩展名记录在主HDU的HDUn关键字中。
+
+    返回:
+        dict: {file_type: {'success': int, 'failed': int}}
+    """
+    size = config['size']
+    stats = {file_type: {'success': 0, 'failed': 0} for file_type in config['file_types']}
+    # 每个目标的所有裁剪：{'{instrument}_{file_type}_{band}': cutout}
+    target_cutouts = [{} for _ in target_ids]
+    target_file_types = [[] for _ in target_ids]
+    
+    for file_type in config['file_types']:
+        tile_file_type = _legacy_file_type(file_type)
+        batch_results = cutout_tile_batch(
+            tile_id, ras, decs, [size] * len(ras), tile_file_type,
+            config.get('mer_root', '/data/astrodata/mirror/102042-Euclid-Q1/MER'),
+            instruments=config.get('instruments'),
+            bands=config.get('bands'),
+            skip_nan=config.get('skip_nan', False),
+            n_threads=config.get('n_threads', 1),
+            files=config.get('tile_files', {}).get((str(tile_id), tile_file_type))
+        )
+        
+        for j, (target_id, result) in enumerate(zip(target_ids, batch_results)):
+            if not result['success']:
+                logger.warning("处理目标%s的%s类型时出错: %s", target_id, file_type, result['error'])
+                stats[file_type]['failed'] += 1
+                continue
+            
+            for cutout in result['cutouts'].values():
+                target_cutouts[j][f"{cutout['instrument']}_{file_type}_{cutout['band']}"] = cutout
+            target_file_types[j].append(file_type)
+    
+    # 每个目标一次写出所有扩展；序列化在本线程，写文件交给后台线程
+    pending_writes = []
+    with _background_writer() as write_file:
+        for target_id, cutouts, file_types in zip(target_ids, target_cutouts, target_file_types):
+            if not cutouts:
+                continue
+            
+            filename = f"{target_id}.fits"
+            try:
+                data = _serialize_cutouts({'success': True, 'cutouts': cutouts, 'error': None},
+                                          obj_id=str(target_id))
+            except Exception as e:
+                logger.warning("序列化%s时出错: %s", filename, e)
+                pending_writes.append((filename, len(cutouts), file_types, None))
+                continue
+            future = write_file(os.path.join(output_dir, filename), data)
+            pending_writes.append((filename, len(cutouts), file_types, future))
+    
+    for filename, n_cutouts, file_types, future in pending_writes:
+        success = future is not None and future.exception() is None
+        if success:
+            logger.debug("已保存 %d 个波段: %s", n_cutouts, filename)
+        else:
+            logger.warning("保存失败: %s", filename)
+        for file_type in file_types:
+            stats[file_type]['success' if success else 'failed'] += 1
+    
+    return stats
+
+
 def _process_single_source(source, source_index, output_dir, config):
     """处理单个源，执行裁剪操作并保存结果"""
     ra = source[config['ra_col']]
     dec = source[config['dec_col']]
-    size = config['size']
-    instruments = config.get('instruments', ['VIS'])
-    file_types = config['file_types']
-    bands = config.get('bands', None)
-    target_id_col = config.get('target_id_col')
     current_target_id = config.get('current_target_id', source_index)
     
     # 获取TILE_ID
-    tile_id = query_tile_id(ra, dec)
+    tile_id = query_tile_id(ra, dec, config.get('tile_index_file', 'data/EuclidQ1_tile_coordinates.fits'))
+    if tile_id is None:
+        raise ValueError(f"坐标({ra}, {dec})无法匹配到TILE_ID")
     
-    # 使用文件缓存（如果提供）
-    tile_files_cache = config.get('tile_files_cache', {})
+    return _cutout_targets(tile_id, [ra], [dec], [current_target_id], output_dir, config)
+
+# 并行worker进程中的任务参数与共享内存中的catalog（由_init_catalog_worker设置）
+_worker_job: Optional[Dict] = None
+_worker_shms: List[shared_memory.SharedMemory] = []
+
+
+class _ForwardToLogger(logging.Handler):
+    """主进程中把worker经队列送回的日志记录交给同名logger处理"""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+@contextlib.contextmanager
+def _worker_log_queue():
+    """
+    worker进程日志的汇集队列
+
+    worker通过_init_worker_logging把本模块的日志放入队列，由主进程中的
+    QueueListener线程统一输出，worker不直接争用stdout和日志文件。
+
+    返回（上下文管理器）:
+        multiprocessing.Queue，作为worker initializer的参数传入
+    """
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, _ForwardToLogger())
+    listener.start()
+    try:
+        yield log_queue
+    finally:
+        listener.stop()
+        log_queue.close()
+
+
+def _init_worker_logging(log_queue) -> None:
+    """worker进程中本模块的日志只放入队列，不再经过继承自主进程的处理器"""
+    if log_queue is not None:
+        logger.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+        logger.propagate = False
+
+
+def _share_array(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, Dict]:
+    """将数组复制到新建的共享内存块，返回(shm, 可pickle的描述信息)"""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, {'shm_name': shm.name, 'shape': array.shape, 'dtype': array.dtype}
+
+
+def _share_catalog(catalog: Dict) -> Tuple[List[shared_memory.SharedMemory], Dict]:
+    """将catalog的结构化数组和掩码放入共享内存
+
+    含object列的数组无法放入共享内存，保持原样（随initializer参数传给每个worker）。
+
+    返回:
+        (shm列表, catalog描述信息)
+    """
+    shms = []
+    spec = {}
+    for key, array in catalog.items():
+        if array is None or array.dtype.hasobject:
+            spec[key] = array
+        else:
+            shm, spec[key] = _share_array(array)
+            shms.append(shm)
+    return shms, spec
+
+
+def _init_catalog_worker(job: Dict, log_queue=None) -> None:
+    """ProcessPoolExecutor的initializer：每个worker只attach一次共享内存中的catalog"""
+    global _worker_job
+    _init_worker_logging(log_queue)
+    catalog = {}
+    for key, spec in job['catalog'].items():
+        if isinstance(spec, dict):
+            shm = shared_memory.SharedMemory(name=spec['shm_name'])
+            _worker_shms.append(shm)
+            catalog[key] = np.ndarray(spec['shape'], dtype=spec['dtype'], buffer=shm.buf)
+        else:
+            catalog[key] = spec
+    _worker_job = dict(job, catalog=catalog)
+
+
+def _catalog_row_dict(catalog: Dict, idx: int, names: Optional[List[str]] = None) -> Dict:
+    """取出catalog的一行，转换为与Table Row取值一致的dict
+
+    键为小写列名；掩码值转换为np.ma.masked，字节串解码为str。
+    names为要取出的列（原始列名），None表示所有列。
+    """
+    data, mask = catalog['data'], catalog['mask']
+    row_dict = {}
+    for name in (data.dtype.names if names is None else names):
+        value = data[name][idx]
+        if mask is not None and np.any(mask[name][idx]):
+            value = np.ma.masked if np.ndim(value) == 0 else np.ma.array(value, mask=mask[name][idx])
+        elif isinstance(value, bytes):
+            value = value.decode('utf-8')
+        row_dict[name.lower()] = value
+    return row_dict
+
+
+def _compute_obj_ids(data: np.ndarray, mask: Optional[np.ndarray], obj_id_col: Optional[str],
+                     ra_col: str, dec_col: str) -> np.ndarray:
+    """
+    一次性生成所有源的obj_id（定长字符串数组）
+
+    obj_id_col的值转换为字符串；未指定ID列或ID被掩码的源使用
+    f"ra_{ra:.6f}_dec_{dec:.6f}"作为ID。列名不区分大小写。
+    """
+    names = {name.lower(): name for name in data.dtype.names}
+    n_rows = len(data)
     
-    # 记录裁剪结果
-    results = []
+    if obj_id_col is not None:
+        name = names[obj_id_col.lower()]
+        values = data[name]
+        if values.dtype.kind == 'S':
+            values = np.char.decode(values, 'utf-8')
+        obj_ids = np.char.mod('%s', values)
+        use_radec = mask[name] if mask is not None else np.zeros(n_rows, dtype=bool)
+    else:
+        obj_ids = np.zeros(n_rows, dtype='U1')
+        use_radec = np.ones(n_rows, dtype=bool)
     
-    # 对每个仪器和文件类型进行裁剪
-    for instrument in instruments:
-        for file_type in file_types:
-            try:
-                # 构建缓存键
-                cache_key = (tile_id, instrument, file_type)
-                
-                # 查找对应的文件（使用缓存或重新查找）
-                if cache_key not in tile_files_cache:
-                    tile_files_cache[cache_key] = find_files(tile_id, instrument=instrument, file_type=file_type)
-                files = tile_files_cache[cache_key]
-                
-                if not files:
-                    raise FileNotFoundError(f"未找到TILE {tile_id}的{instrument}仪器{file_type}类型文件")
-                
-                # 根据文件类型执行不同的裁剪操作
-                if file_type == 'PSF':
-                    # PSF文件裁剪
-                    cutout_result = cutout_psf(files, ra, dec)
-                    if cutout_result:
-                        results.append((instrument, file_type, None, cutout_result))
-                else:
-                    # 图像文件裁剪 - 处理所有匹配的波段文件
-                    for file in files:
-                        # 从文件名解析波段，修复解包错误
-                        parsed = _parse_filename(file)
-                        if parsed is not None:
-                            file_instrument, band = parsed
-                            # 使用从文件名解析出的仪器名称
-                            if file_instrument != instrument:
-                                print(f"警告: 文件 {file} 中的仪器 {file_instrument} 与预期 {instrument} 不匹配")
-                        else:
-                            # 如果解析失败，跳过此文件
-                            print(f"警告: 无法解析文件 {file} 的仪器和波段信息")
-                            continue
-                            
-                        cutout_result = cutout_image(file, ra, dec, size)
-                        results.append((instrument, file_type, band, cutout_result))
-            
-            except Exception as e:
-                print(f"处理目标{current_target_id}的{instrument}仪器{file_type}类型时出错: {e}")
-                continue
+    if np.any(use_radec):
+        ra = np.asarray(data[names[ra_col.lower()]][use_radec], dtype=np.float64)
+        dec = np.asarray(data[names[dec_col.lower()]][use_radec], dtype=np.float64)
+        radec_ids = np.char.add(np.char.add('ra_', np.char.mod('%.6f', ra)),
+                                np.char.add('_dec_', np.char.mod('%.6f', dec)))
+        obj_ids = obj_ids.astype(np.result_type(obj_ids, radec_ids))
+        obj_ids[use_radec] = radec_ids
     
-    # 保存裁剪结果 - 按波段分组保存
-    # 按 (instrument, file_type, band) 分组裁剪结果
-    cutout_results_by_band = {}
-    for instrument, file_type, band, cutout_data in results:
-        if cutout_data['success']:
-            band_key = f"{instrument}_{file_type}_{band}"
-            if band_key not in cutout_results_by_band:
-                cutout_results_by_band[band_key] = {
-                    'success': True,
-                    'cutouts': {},
-                    'error': None
-                }
-            
-            # 为每个波段创建单独的cutout条目
-            cutout_results_by_band[band_key]['cutouts'][f"{instrument}_{band}"] = {
-                'success': True,
-                'data': cutout_data['data'],
-                'wcs': cutout_data.get('wcs'),
-                'header': cutout_data.get('header'),
-                'instrument': instrument,
-                'band': band,
-                'contains_nan': cutout_data.get('contains_nan', False)
-            }
-    
-    # 保存每个波段的裁剪结果到单独的文件
-    for band_key, band_cutouts in cutout_results_by_band.items():
-        try:
-            instrument, file_type, band = band_key.split('_', 2)
-            filename = f"{current_target_id}_{band}.fits"
-            
-            # 保存到输出目录
-            output_path = os.path.join(output_dir, filename)
-            
-            if band_cutouts['cutouts']:
-                # 转换为正确的cutout_tile格式
-                cutout_result_for_save = {
-                    'success': True,
-                    'cutouts': band_cutouts['cutouts'],
-                    'error': None
-                }
-                
-                success = save_cutouts(
-                    output_path=output_path,
-                    cutouts_result=cutout_result_for_save,
-                    obj_id=str(current_target_id)
-                )
-                
-                if success:
-                    print(f"已保存波段 {band}: {filename}")
-                else:
-                    print(f"保存波段 {band}失败: {filename}")
-            else:
-                print(f"波段 {band}没有有效的裁剪结果")
-                
-        except Exception as e:
-            print(f"保存波段 {band}结果时出错: {e}")
-            continue
+    return obj_ids
 
-def _process_single_source_parallel(args):
-    """单个源的处理函数，用于并行处理"""
-    try:
-        (idx, row_dict, ra_col, dec_col, size_col, obj_id_col, file_types,
-         output_dir, mer_root, instruments, bands,
-         skip_nan, default_size, save_catalog_row, verbose) = args
 
+def _parse_source_args(idx: int, row_dict: Dict, job: Dict) -> Dict:
+    """解析单个源的坐标、尺寸、ID和TILE_ID"""
+    ra_col, dec_col = job['ra_col'], job['dec_col']
+    size_col, obj_id_col = job['size_col'], job['obj_id_col']
+    try:
         ra = row_dict[ra_col]
         dec = row_dict[dec_col]
 
@@ -719,18 +1599,10 @@ def _process_single_source_parallel(args):
             if isinstance(size, (list, tuple, np.ndarray)) and len(size) == 2:
                 size = tuple(size)
         else:
-            size = default_size
-
-        # 确保obj_id是字符串类型，避免MaskedConstant导致的哈希错误
-        if obj_id_col:
-            raw_obj_id = row_dict[obj_id_col]
-            # 检查是否为MaskedConstant类型或其他特殊类型
-            if hasattr(raw_obj_id, 'mask'):  # MaskedConstant类型
-                obj_id = f"ra_{ra:.6f}_dec_{dec:.6f}"  # 如果是掩码值，使用RA/Dec作为备用ID
-            else:
-                obj_id = str(raw_obj_id)  # 转换为字符串
-        else:
-            obj_id = f"ra_{ra:.6f}_dec_{dec:.6f}"  # 使用RA/Dec作为ID
+            size = job['default_size']
+
+        # obj_id已在process_catalog中由_compute_obj_ids整列生成
+        obj_id = str(job['catalog']['obj_id'][idx])
 
         # 直接从row_dict中获取TILE_ID（已在process_catalog中预处理）
         # Note: all keys are lowercase now
@@ -743,66 +1615,177 @@ def _process_single_source_parallel(args):
         traceback.print_exc(file=sys.stderr)
         raise
     
+    return {'idx': idx, 'row_dict': row_dict, 'ra': ra, 'dec': dec,
+            'size': size, 'obj_id': obj_id, 'tile_id': tile_id}
+
+
+def _process_tile_sources(indices: List[int], job: Optional[Dict] = None) -> List[Dict]:
+    """处理一批属于同一TILE的源
+
+    每种文件类型调用一次cutout_tile_batch，使每个波段文件只打开一次。
+    并行时job为None，使用worker初始化时attach的共享catalog。
+
+    参数:
+        indices: 源在catalog中的行号
+        job: process_catalog构建的任务参数（含catalog数组）
+
+    返回:
+        list: 每个源一个 {'obj_id': str, 'results': {file_type: status}}
+    """
+    if job is None:
+        job = _worker_job
+    file_types = job['file_types']
+    output_dir = job['output_dir']
+    save_catalog_row = job['save_catalog_row']
+    verbose = job['verbose']
+
+    # 不保存catalog行时只取出解析所需的几列，宽表不必逐行转换所有列
+    names = None if save_catalog_row else job['key_columns']
+    sources = [_parse_source_args(idx, _catalog_row_dict(job['catalog'], idx, names), job)
+               for idx in indices]
+    source_results = [{} for _ in sources]
+    
     # 如果TILE_ID为空字符串，说明无法匹配
-    if not tile_id or tile_id == '':
-        if verbose:
-            print(f"[ERROR] obj_{idx} ({ra:.4f}, {dec:.4f}): 无法找到对应的TILE")
-        return {'obj_id': obj_id, 'results': {ft: 'no_tile' for ft in file_types}}
+    tile_sources = []
+    for source, results in zip(sources, source_results):
+        if not source['tile_id'] or source['tile_id'] == '':
+            if verbose:
+                logger.warning("obj_%s (%.4f, %.4f): 无法找到对应的TILE",
+                               source['idx'], source['ra'], source['dec'])
+            results.update({ft: 'no_tile' for ft in file_types})
+        else:
+            tile_sources.append((source, results))
     
-    results = {}
-    for file_type in file_types:
-        try:
-            cutout_result = cutout_tile(
-                tile_id=str(tile_id),
-                ra=ra,
-                dec=dec,
-                size=size,
-                file_type=file_type,
-                mer_root=mer_root,
-                instruments=instruments,
-                bands=bands,
-                skip_nan=skip_nan
-            )
-            
-            if cutout_result['success']:
+    if tile_sources:
+        tile_id = str(tile_sources[0][0]['tile_id'])
+        ra_list = [source['ra'] for source, _ in tile_sources]
+        dec_list = [source['dec'] for source, _ in tile_sources]
+        size_list = [source['size'] for source, _ in tile_sources]
+        
+        save_zarr = job['output_format'] == 'zarr'
+        # 本批次打开的zarr数组，批次结束即释放
+        zarr_arrays = {}
+        
+        # 文件写入交给后台线程，与后续源的裁剪和序列化重叠；写入失败在退出后统一回填
+        pending_writes = []
+        with _background_writer() as write_file:
+            for file_type in file_types:
+                # 与源无关的量在内层循环外计算
                 file_output_dir = os.path.join(output_dir, file_type)
-                output_path = os.path.join(file_output_dir, f"{obj_id}.fits")
-
-                # Convert dict back to Table Row for saving if needed
-                save_row = None
-                if save_catalog_row and file_type == file_types[0]:
-                    # Create a single-row Table from the dict
-                    from astropy.table import Table
-                    temp_table = Table({k: [v] for k, v in row_dict.items()})
-                    save_row = temp_table[0]
-
-                success = save_cutouts(
-                    output_path=output_path,
-                    cutouts_result=cutout_result,
-                    obj_id=obj_id,
-                    catalog_row=save_row,
-                    verbose=verbose
-                )
+                with_catalog_row = save_catalog_row and file_type == file_types[0]
+                try:
+                    cutout_results = cutout_tile_batch(
+                        tile_id=tile_id,
+                        ra=ra_list,
+                        dec=dec_list,
+                        sizes=size_list,
+                        file_type=file_type,
+                        mer_root=job['mer_root'],
+                        instruments=job['instruments'],
+                        bands=job['bands'],
+                        skip_nan=job['skip_nan'],
+                        n_threads=job['n_threads'],
+                        files=job['tile_files'].get((tile_id, file_type))
+                    )
+                except Exception as e:
+                    for source, results in tile_sources:
+                        results[file_type] = f'error: {str(e)}'
+                        if verbose:
+                            logger.warning("%s %s: %s", source['obj_id'], file_type, e)
+                    continue
                 
-                if success:
-                    results[file_type] = 'success'
-                else:
-                    results[file_type] = 'save_failed'
-                    if verbose:
-                        print(f"[ERROR] {obj_id} {file_type}: 保存失败")
-            else:
-                error_msg = cutout_result.get('error', 'Unknown error')
-                results[file_type] = f'cutout_failed: {error_msg}'
-                # 只在非批量模式或明确需要详细输出时打印错误信息
-                if verbose and len(results) == 1:
-                    print(f"[ERROR] {obj_id} {file_type}: {error_msg}")
+                for (source, results), cutout_result in zip(tile_sources, cutout_results):
+                    obj_id = source['obj_id']
+                    try:
+                        if cutout_result['success'] and save_zarr:
+                            if _save_cutouts_zarr(output_dir, file_type, source['idx'], cutout_result,
+                                                  zarr_arrays):
+                                results[file_type] = 'success'
+                            else:
+                                results[file_type] = 'save_failed'
+                        elif cutout_result['success']:
+                            output_path = os.path.join(file_output_dir, f"{obj_id}.fits")
+
+                            # Convert dict back to Table Row for saving if needed
+                            save_row = None
+                            if with_catalog_row:
+                                # Create a single-row Table from the dict
+                                temp_table = Table({k: [v] for k, v in source['row_dict'].items()})
+                                save_row = temp_table[0]
+
+                            try:
+                                data = _serialize_cutouts(cutout_result, obj_id, save_row)
+                            except Exception as e:
+                                data = None
+                                if verbose:
+                                    logger.warning("保存FITS文件时出错: %s", e)
+                            
+                            if data is not None:
+                                results[file_type] = 'success'
+                                pending_writes.append((results, file_type, obj_id,
+                                                       write_file(output_path, data)))
+                            else:
+                                results[file_type] = 'save_failed'
+                                if verbose:
+                                    logger.warning("%s %s: 保存失败", obj_id, file_type)
+                        else:
+                            error_msg = cutout_result.get('error', 'Unknown error')
+                            results[file_type] = f'cutout_failed: {error_msg}'
+                            # 只在非批量模式或明确需要详细输出时打印错误信息
+                            if verbose and len(results) == 1:
+                                logger.warning("%s %s: %s", obj_id, file_type, error_msg)
+                    
+                    except Exception as e:
+                        results[file_type] = f'error: {str(e)}'
+                        if verbose:
+                            logger.warning("%s %s: %s", obj_id, file_type, e)
         
-        except Exception as e:
-            results[file_type] = f'error: {str(e)}'
-            if verbose:
-                print(f"[ERROR] {obj_id} {file_type}: {str(e)}")
+        for results, file_type, obj_id, future in pending_writes:
+            try:
+                future.result()
+            except Exception as e:
+                results[file_type] = 'save_failed'
+                if verbose:
+                    logger.warning("%s %s: 保存失败: %s", obj_id, file_type, e)
+    
+    return [{'obj_id': source['obj_id'], 'results': results}
+            for source, results in zip(sources, source_results)]
+
+
+def _process_tile_sources_safe(indices: List[int], job: Optional[Dict] = None) -> List[Dict]:
+    """_process_tile_sources的包装，用于executor.map
+
+    map在遇到第一个异常时会中断迭代，因此在worker内捕获异常并作为结果返回
+    """
+    try:
+        return _process_tile_sources(indices, job)
+    except Exception as e:
+        import traceback
+        return [{'exception': str(e), 'traceback': traceback.format_exc()}
+                for _ in indices]
+
+
+def _group_indices_by_tile(tile_ids, batch_size: Optional[int] = None) -> List[List[int]]:
+    """
+    按TILE_ID将行号分组，并把每组切分为不超过batch_size的批次
+
+    对TILE_ID做一次稳定排序，在相邻值变化处切分，组内保持原始行顺序。
+    batch_size为None时不切分。
+    """
+    tile_ids = np.asarray(tile_ids)
+    if len(tile_ids) == 0:
+        return []
+    
+    order = np.argsort(tile_ids, kind='stable')
+    sorted_ids = tile_ids[order]
+    bounds = np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1
     
-    return {'obj_id': obj_id, 'results': results}
+    batches = []
+    for group in np.split(order, bounds):
+        step = batch_size or len(group)
+        for start in range(0, len(group), step):
+            batches.append(group[start:start + step].tolist())
+    return batches
 
 
 def _process_tile_group(tile_id, tile_sources, output_dir, config, original_indices):
@@ -814,14 +1797,32 @@ def _process_tile_group(tile_id, tile_sources, output_dir, config, original_indi
             _process_single_source(source, original_idx, output_dir, config)
             stats['success'] += 1
         except Exception as e:
-            print(f"处理TILE {tile_id}中的源{original_idx}失败: {e}")
+            logger.warning("处理TILE %s中的源%s失败: %s", tile_id, original_idx, e)
             stats['error'] += 1
     
     return stats
 
+# process_catalog_by_tile的worker进程中的公共配置（由_init_tile_group_worker设置）
+_worker_tile_config = None
+
+
+def _init_tile_group_worker(config, log_queue=None):
+    """ProcessPoolExecutor的initializer：公共配置（含TILE文件列表）每个worker只传一次"""
+    global _worker_tile_config
+    _worker_tile_config = config
+    _init_worker_logging(log_queue)
+
+
+# 任务进度写入tasks字典的最小间隔（秒）
+PROGRESS_UPDATE_INTERVAL = 1.0
+
+
 def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_col='DEC', size=100, 
                           instruments=None, bands=None, target_id_col=None, parallel=True, 
-                          n_workers=4, verbose=False, task_id=None, tasks=None, tasks_lock=None):
+                          n_workers=4, verbose=False, task_id=None, tasks=None, tasks_lock=None,
+                          tile_index_file='data/EuclidQ1_tile_coordinates.fits',
+                          mer_root='/data/astrodata/mirror/102042-Euclid-Q1/MER',
+                          executor_type='process', n_threads=1):
     """
     按TILE_ID分配进程处理星表，每个TARGETID裁剪一个图像fits文件
     
@@ -841,10 +1842,17 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
         task_id: 任务ID（用于进度更新）
         tasks: 任务字典（用于进度更新）
         tasks_lock: 任务锁（用于进度更新）
+        tile_index_file: TILE索引文件路径
+        mer_root: MER数据根目录
+        executor_type: 并行方式，'process'为进程池，'thread'为线程池
+        n_threads: 每个TILE组内并行读取裁剪窗口的线程数（远程数据时用于并发range请求）
     
     返回:
         处理统计信息字典
     """
+    if executor_type not in ('process', 'thread'):
+        raise ValueError(f"不支持的并行方式: {executor_type}")
+    
     # 确保输出目录存在
     os.makedirs(output_dir, exist_ok=True)
     
@@ -853,10 +1861,6 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
     for file_type in file_types:
         stats[file_type] = {'success': 0, 'failed': 0, 'total': len(catalog)}
     
-    # 为所有源获取TILE_ID
-    ra_list = catalog[ra_col].tolist()
-    dec_list = catalog[dec_col].tolist()
-    tile_ids = []
     target_ids = []
     
     # 收集TARGET_IDs
@@ -865,24 +1869,25 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
     else:
         target_ids = list(range(len(catalog)))
     
-    # 使用query_tile_id批量获取TILE_ID
-    for ra, dec in zip(ra_list, dec_list):
-        try:
-            tile_id = query_tile_id(ra, dec)
-            tile_ids.append(tile_id)
-        except Exception as e:
-            print(f"获取坐标({ra}, {dec})的TILE_ID失败: {e}")
-            tile_ids.append(None)
+    # 坐标一次性取出为float64数组：查询TILE_ID后，每组只把该组的坐标切片交给worker，
+    # 不再pickle整组的Table行
+    ra_values = np.asarray(catalog[ra_col], dtype=np.float64)
+    dec_values = np.asarray(catalog[dec_col], dtype=np.float64)
+    
+    # 为所有源批量获取TILE_ID
+    tile_ids = query_tile_ids(ra_values, dec_values, tile_index_file)
     
-    # 按TILE_ID分组
+    # 按TILE_ID分组（与process_catalog使用相同的分组方式）
     tile_groups = {}
-    for idx, (tile_id, target_id) in enumerate(zip(tile_ids, target_ids)):
-        if tile_id not in tile_groups:
-            tile_groups[tile_id] = []
-        tile_groups[tile_id].append((idx, target_id))
+    for indices in _group_indices_by_tile(['' if tile_id is None else tile_id for tile_id in tile_ids]):
+        tile_groups[tile_ids[indices[0]]] = [(idx, target_ids[idx]) for idx in indices]
     
     print(f"共找到 {len(tile_groups)} 个不同的TILE_ID")
     
+    # 在主进程中为每个TILE查找一次文件
+    tile_files = find_tile_files(list(tile_groups), [_legacy_file_type(ft) for ft in file_types],
+                                 mer_root, instruments, bands)
+    
     # 配置参数
     config = {
         'file_types': file_types,
@@ -891,29 +1896,64 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
         'size': size,
         'instruments': instruments,
         'bands': bands,
-        'target_id_col': target_id_col
+        'target_id_col': target_id_col,
+        'tile_index_file': tile_index_file,
+        'mer_root': mer_root,
+        'tile_files': tile_files,
+        'n_threads': n_threads
     }
     
     # 初始化进度
     processed_count = 0
     total_sources = len(catalog)
+    last_progress_update = 0.0
+    
+    def report_progress(force=False):
+        """写入任务进度，最多每PROGRESS_UPDATE_INTERVAL秒一次，避免频繁争用tasks_lock"""
+        nonlocal last_progress_update
+        if not (task_id and tasks and tasks_lock):
+            return
+        now = time.monotonic()
+        if not force and now - last_progress_update < PROGRESS_UPDATE_INTERVAL:
+            return
+        last_progress_update = now
+        if total_sources == 0:
+            progress = 90  # 空星表没有需要处理的源
+        else:
+            progress = int(30 + (processed_count / total_sources) * 60)  # 30%-90%
+        with tasks_lock:
+            tasks[task_id]['progress'] = min(progress, 90)
+            tasks[task_id]['message'] = f"正在处理: {processed_count}/{total_sources}"
     
-    # 并行处理 - 每个TILE_ID一个进程
+    # 并行处理 - 每个TILE_ID一个任务
     if parallel:
-        with ProcessPoolExecutor(max_workers=min(n_workers, len(tile_groups))) as executor:
+        max_workers = min(n_workers, len(tile_groups))
+        with contextlib.ExitStack() as stack:
+            if executor_type == 'thread':
+                # 线程直接共享配置
+                executor = stack.enter_context(ThreadPoolExecutor(max_workers=max_workers))
+                task_config = config
+            else:
+                # 配置通过initializer每个worker只传一次，任务只携带该TILE的源；
+                # worker日志经队列回到主进程输出（executor先关闭，队列后停止）
+                log_queue = stack.enter_context(_worker_log_queue())
+                executor = stack.enter_context(ProcessPoolExecutor(
+                    max_workers=max_workers, initializer=_init_tile_group_worker,
+                    initargs=(config, log_queue)))
+                task_config = None
             # 提交任务
             future_to_tile = {}
             for tile_id, source_info in tile_groups.items():
                 if tile_id is not None:
                     # 提取此TILE的源索引和目标ID
                     source_indices = [idx for idx, _ in source_info]
-                    tile_sources = catalog[source_indices]
                     # 传递目标ID列表
                     tile_target_ids = [target_id for _, target_id in source_info]
                     
                     future = executor.submit(
                         _process_tile_group_with_targets, 
-                        tile_id, tile_sources, output_dir, config, source_indices, tile_target_ids
+                        tile_id, ra_values[source_indices], dec_values[source_indices],
+                        output_dir, task_config, tile_target_ids
                     )
                     future_to_tile[future] = tile_id
                 else:
@@ -929,13 +1969,9 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
                             
                             # 更新进度
                             processed_count += 1
-                            if task_id and tasks and tasks_lock:
-                                progress = int(30 + (processed_count / total_sources) * 60)  # 30%-90%
-                                with tasks_lock:
-                                    tasks[task_id]['progress'] = min(progress, 90)
-                                    tasks[task_id]['message'] = f"正在处理: {processed_count}/{total_sources}"
+                            report_progress()
                         except Exception as e:
-                            print(f"处理目标{target_id}失败: {e}")
+                            logger.warning("处理目标%s失败: %s", target_id, e)
                             for file_type in file_types:
                                 stats[file_type]['failed'] += 1
             
@@ -952,15 +1988,12 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
                     
                     # 更新进度
                     processed_count += result.get('count', 0)
-                    if task_id and tasks and tasks_lock:
-                        progress = int(30 + (processed_count / total_sources) * 60)
-                        with tasks_lock:
-                            tasks[task_id]['progress'] = min(progress, 90)
-                            tasks[task_id]['message'] = f"正在处理: {processed_count}/{total_sources}"
+                    report_progress()
                             
-                    print(f"TILE {tile_id} 处理完成: 成功{sum(r['success'] for r in result.values())}个源")
+                    n_success = sum(result[ft]['success'] for ft in file_types if ft in result)
+                    logger.info("TILE %s 处理完成: 成功%d个源", tile_id, n_success)
                 except Exception as e:
-                    print(f"处理TILE {tile_id}失败: {e}")
+                    logger.warning("处理TILE %s失败: %s", tile_id, e)
                     # 标记此TILE中的所有源为失败
                     failed_count = len(tile_groups[tile_id])
                     for file_type in file_types:
@@ -971,11 +2004,11 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
             if tile_id is not None:
                 try:
                     source_indices = [idx for idx, _ in source_info]
-                    tile_sources = catalog[source_indices]
                     tile_target_ids = [target_id for _, target_id in source_info]
                     
                     result = _process_tile_group_with_targets(
-                        tile_id, tile_sources, output_dir, config, source_indices, tile_target_ids
+                        tile_id, ra_values[source_indices], dec_values[source_indices],
+                        output_dir, config, tile_target_ids
                     )
                     
                     # 更新统计信息
@@ -986,13 +2019,9 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
                     
                     # 更新进度
                     processed_count += result.get('count', 0)
-                    if task_id and tasks and tasks_lock:
-                        progress = int(30 + (processed_count / total_sources) * 60)
-                        with tasks_lock:
-                            tasks[task_id]['progress'] = min(progress, 90)
-                            tasks[task_id]['message'] = f"正在处理: {processed_count}/{total_sources}"
+                    report_progress()
                 except Exception as e:
-                    print(f"处理TILE {tile_id}失败: {e}")
+                    logger.warning("处理TILE %s失败: %s", tile_id, e)
             else:
                 for idx, target_id in source_info:
                     source = catalog[idx]
@@ -1002,10 +2031,13 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
                         for file_type in file_types:
                             stats[file_type]['success'] += 1
                     except Exception as e:
-                        print(f"处理目标{target_id}失败: {e}")
+                        logger.warning("处理目标%s失败: %s", target_id, e)
                         for file_type in file_types:
                             stats[file_type]['failed'] += 1
     
+    # 写入最终进度
+    report_progress(force=True)
+    
     # 打印最终统计信息
     for file_type in file_types:
         success = stats[file_type]['success']
@@ -1015,36 +2047,23 @@ def process_catalog_by_tile(catalog, output_dir, file_types, ra_col='RA', dec_co
     
     return stats
 
-def _process_tile_group_with_targets(tile_id, tile_sources, output_dir, config, original_indices, target_ids):
-    """处理一组属于同一TILE的源，并使用TARGET_ID命名文件"""
-    # 初始化统计信息
-    stats = {}
-    for file_type in config['file_types']:
-        stats[file_type] = {'success': 0, 'failed': 0}
-    stats['count'] = len(tile_sources)
-    
-    # 预先加载该TILE的文件信息，减少重复查找
-    tile_files_cache = {}
+def _process_tile_group_with_targets(tile_id, ras, decs, output_dir, config, target_ids):
+    """处理一组属于同一TILE的源，并使用TARGET_ID命名文件
+
+    整组源一起裁剪：每个(文件类型, 波段)文件只打开一次，所有源在一次遍历中完成切片。
+    ras/decs为该组源的坐标数组（任务只携带坐标和目标ID，不携带Table行）。
+    并行时config为None，使用worker初始化时传入的配置。
+    """
+    if config is None:
+        config = _worker_tile_config
     
-    # 处理每个源
-    for i, (source, original_idx, target_id) in enumerate(zip(tile_sources, original_indices, target_ids)):
-        try:
-            # 设置当前目标ID
-            config['current_target_id'] = target_id
-            config['tile_files_cache'] = tile_files_cache  # 传递文件缓存
-            
-            # 处理单个源
-            _process_single_source(source, original_idx, output_dir, config)
-            
-            # 更新所有文件类型的成功计数
-            for file_type in config['file_types']:
-                stats[file_type]['success'] += 1
-                
-        except Exception as e:
-            print(f"处理TILE {tile_id}中的目标{target_id}失败: {e}")
-            # 更新所有文件类型的失败计数
-            for file_type in config['file_types']:
-                stats[file_type]['failed'] += 1
+    try:
+        stats = _cutout_targets(tile_id, ras, decs, list(target_ids), output_dir, config)
+    except Exception as e:
+        logger.warning("处理TILE %s失败: %s", tile_id, e)
+        stats = {file_type: {'success': 0, 'failed': len(target_ids)}
+                 for file_type in config['file_types']}
+    stats['count'] = len(target_ids)
     
     return stats
 
@@ -1056,7 +2075,10 @@ def process_catalog(catalog: Table, output_dir: str, file_types: List[str],
                     mer_root: str = '/data/astrodata/mirror/102042-Euclid-Q1/MER',
                     instruments: Optional[List[str]] = None, bands: Optional[List[str]] = None,
                     skip_nan: bool = True, save_catalog_row: bool = True,
-                    parallel: bool = False, n_workers: int = 4, verbose: bool = False) -> Dict:
+                    parallel: bool = False, n_workers: int = 4, verbose: bool = False,
+                    output_format: str = 'fits', executor_type: str = 'process',
+                    on_saved: Optional[Callable[[str], None]] = None,
+                    n_threads: int = 1) -> Dict:
     """
     批量处理catalog
     
@@ -1078,6 +2100,15 @@ def process_catalog(catalog: Table, output_dir: str, file_types: List[str],
         parallel: 是否并行处理
         n_workers: 并行worker数量
         verbose: 是否输出详细错误信息
+        output_format: 'fits'为每个源每种文件类型一个FITS文件；'zarr'将每种文件类型、
+            每个波段的所有裁剪写入一个(N, H, W)的zarr数组（output_dir/{file_type}.zarr/{波段}），
+            第i行对应catalog第i个源，catalog（含TILE_ID）另存为output_dir/catalog.fits
+        executor_type: 并行方式，'process'为进程池（catalog经共享内存传给worker），
+            'thread'为线程池（读写主要在C层释放GIL，省去进程启动和数据传递）
+        on_saved: 可选回调，output_format='fits'时在主进程中对每个写出成功的文件路径调用一次，
+            调用方可据此在裁剪进行的同时处理已完成的文件（如边裁剪边打包）
+        n_threads: 串行模式下同一图像内并行读取裁剪窗口的线程数，默认1（不使用线程池）；
+            并行模式下忽略，每个worker单线程，避免超额订阅
         
     返回:
         dict: 统计信息 {file_type: {'success': int, 'failed': int, 'errors': list}}
@@ -1086,21 +2117,37 @@ def process_catalog(catalog: Table, output_dir: str, file_types: List[str],
     if ra_col not in catalog.colnames or dec_col not in catalog.colnames:
         raise ValueError(f"catalog必须包含指定的RA/DEC列: {ra_col}, {dec_col}")
     
+    if output_format not in ('fits', 'zarr'):
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    if executor_type not in ('process', 'thread'):
+        raise ValueError(f"不支持的并行方式: {executor_type}")
+    if output_format == 'zarr':
+        if zarr is None:
+            raise ImportError("output_format='zarr'需要安装zarr")
+        if size_col is not None:
+            raise ValueError("output_format='zarr'要求所有源使用统一的size")
+        if 'CATALOG-PSF' in file_types:
+            raise ValueError("output_format='zarr'不支持CATALOG-PSF（PSF尺寸由文件决定）")
+    
     if obj_id_col is None:
         if 'OBJECT_ID' in catalog.colnames:
             obj_id_col = 'OBJECT_ID'
         elif 'ID' in catalog.colnames:
             obj_id_col = 'ID'
+    elif obj_id_col.lower() not in {name.lower() for name in catalog.colnames}:
+        raise ValueError(f"catalog中不存在ID列: {obj_id_col}")
     
-    # 批量获取TILE_ID（如果catalog中没有）
-    catalog_with_tile = catalog.copy()
+    # 批量获取TILE_ID（如果catalog中没有）；新表与输入共享列数据，
+    # 只新增TILE_ID列，不复制整张catalog
+    catalog_with_tile = Table(catalog, copy=False)
     if 'TILE_ID' not in catalog.colnames:
         if verbose:
             print("正在批量查询TILE_ID...")
-        tile_ids = []
-        for row in tqdm(catalog, desc="查询TILE_ID", disable=not verbose):
-            tile_id = query_tile_id(row[ra_col], row[dec_col], tile_index_file)
-            tile_ids.append(tile_id if tile_id is not None else '')
+        # 一次性取出连续的float64坐标数组，整表批量查询
+        ra_values = np.ascontiguousarray(np.ma.getdata(catalog[ra_col]), dtype=np.float64)
+        dec_values = np.ascontiguousarray(np.ma.getdata(catalog[dec_col]), dtype=np.float64)
+        tile_ids = [tile_id if tile_id is not None else ''
+                    for tile_id in query_tile_ids(ra_values, dec_values, tile_index_file)]
         catalog_with_tile['TILE_ID'] = tile_ids
         
         # 统计无TILE_ID的源
@@ -1110,80 +2157,113 @@ def process_catalog(catalog: Table, output_dir: str, file_types: List[str],
     
     stats = {ft: {'success': 0, 'failed': 0, 'errors': []} for ft in file_types}
     
-    # Convert rows to dicts for better serialization in multiprocessing
-    # Also normalize column names to lowercase for case-insensitive access
-    args_list = [
-        (idx, {col.lower(): row[col] for col in row.colnames},
-         ra_col.lower(), dec_col.lower(),
-         size_col.lower() if size_col else None,
-         obj_id_col.lower() if obj_id_col else None,
-         file_types,
-         output_dir, mer_root, instruments, bands,
-         skip_nan, size, save_catalog_row, verbose)
-        for idx, row in enumerate(catalog_with_tile)
-    ]
+    # catalog转换为结构化数组：并行时放入共享内存，worker只接收行号，
+    # 避免逐行pickle；列名在worker中统一转换为小写以便不区分大小写访问
+    catalog_array = catalog_with_tile.as_array()
+    catalog_data = np.ma.getdata(catalog_array)
+    catalog_mask = np.ma.getmaskarray(catalog_array) if np.ma.isMaskedArray(catalog_array) else None
+    job = {
+        'catalog': {
+            'data': catalog_data,
+            'mask': catalog_mask,
+            'obj_id': _compute_obj_ids(catalog_data, catalog_mask, obj_id_col, ra_col, dec_col)
+        },
+        'ra_col': ra_col.lower(),
+        'dec_col': dec_col.lower(),
+        'size_col': size_col.lower() if size_col else None,
+        'obj_id_col': obj_id_col.lower() if obj_id_col else None,
+        'file_types': file_types,
+        'output_dir': output_dir,
+        'mer_root': mer_root,
+        'instruments': instruments,
+        'bands': bands,
+        'skip_nan': skip_nan,
+        'default_size': size,
+        'save_catalog_row': save_catalog_row,
+        'verbose': verbose,
+        # 串行模式下可选用线程并行读取同一图像中的多个窗口；并行模式下每个worker单线程，避免超额订阅
+        'n_threads': 1 if parallel else max(1, n_threads),
+        # 每个TILE只扫描一次目录，随worker初始化参数一次性传入
+        'tile_files': find_tile_files(catalog_with_tile['TILE_ID'].tolist(), file_types,
+                                      mer_root, instruments, bands),
+        'output_format': output_format
+    }
+    key_columns = {job['ra_col'], job['dec_col'], job['size_col'], 'tile_id'}
+    job['key_columns'] = [name for name in catalog_with_tile.colnames if name.lower() in key_columns]
+    n_sources = len(catalog_with_tile)
+    
+    if output_format == 'zarr':
+        _ensure_dir(output_dir)
+        _create_zarr_arrays(output_dir, file_types, job['tile_files'], n_sources, _cutout_shape(size))
+        catalog_with_tile.write(os.path.join(output_dir, 'catalog.fits'), overwrite=True)
     
+    # 按TILE_ID分组，同一TILE的源交给同一个worker批量裁剪，使每个文件只打开一次；
+    # 并行时再按批大小切分大的分组，保证各worker负载均衡
     if parallel:
-        with ProcessPoolExecutor(max_workers=n_workers) as executor:
-            futures = {executor.submit(_process_single_source_parallel, args): args 
-                      for args in args_list}
-            
-            pbar = tqdm(total=len(futures), desc="批量裁剪", position=0, leave=True)
-            
-            for future in as_completed(futures):
-                try:
-                    result_dict = future.result()
-                    obj_id = result_dict['obj_id']
-                    results = result_dict['results']
-                    
-                    for file_type, status in results.items():
-                        if status == 'success':
-                            stats[file_type]['success'] += 1
-                        else:
-                            stats[file_type]['failed'] += 1
-                            if verbose and len(stats[file_type]['errors']) < 10:
-                                stats[file_type]['errors'].append(f"{obj_id}: {status}")
-                except Exception as e:
+        batch_size = max(1, -(-n_sources // (4 * n_workers)))
+    else:
+        batch_size = max(1, n_sources)
+    tile_batches = _group_indices_by_tile(catalog_with_tile['TILE_ID'], batch_size)
+    
+    executor = None
+    shms = []
+    log_stack = contextlib.ExitStack()
+    try:
+        if parallel and executor_type == 'thread':
+            executor = ThreadPoolExecutor(max_workers=n_workers)
+            batch_results = executor.map(functools.partial(_process_tile_sources_safe, job=job),
+                                         tile_batches)
+        elif parallel:
+            log_queue = log_stack.enter_context(_worker_log_queue())
+            shms, catalog_spec = _share_catalog(job['catalog'])
+            executor = ProcessPoolExecutor(max_workers=n_workers,
+                                           initializer=_init_catalog_worker,
+                                           initargs=(dict(job, catalog=catalog_spec), log_queue))
+            batch_results = executor.map(_process_tile_sources_safe, tile_batches)
+        else:
+            batch_results = (_process_tile_sources_safe(indices, job) for indices in tile_batches)
+        
+        pbar = tqdm(total=n_sources, desc="批量裁剪", position=0, leave=True)
+        
+        for result_list in batch_results:
+            for result_dict in result_list:
+                if 'exception' in result_dict:
                     if verbose:
-                        import traceback
-                        print(f"\n[CRITICAL ERROR] 处理任务时出错: {str(e)}", file=sys.stderr)
+                        print(f"\n[CRITICAL ERROR] 处理任务时出错: {result_dict['exception']}", file=sys.stderr)
                         print(f"详细错误信息:", file=sys.stderr)
-                        traceback.print_exc(file=sys.stderr)
+                        print(result_dict['traceback'], file=sys.stderr)
                     for file_type in file_types:
                         stats[file_type]['failed'] += 1
+                    continue
                 
-                # 更新进度条描述显示当前统计
-                total_success = sum(s['success'] for s in stats.values())
-                total_failed = sum(s['failed'] for s in stats.values())
-                pbar.set_postfix({'成功': total_success, '失败': total_failed}, refresh=True)
-                pbar.update(1)
-            
-            pbar.close()
-    else:
-        pbar = tqdm(args_list, desc="批量裁剪", position=0, leave=True)
-        for args in pbar:
-            try:
-                result_dict = _process_single_source_parallel(args)
                 obj_id = result_dict['obj_id']
                 results = result_dict['results']
                 
                 for file_type, status in results.items():
                     if status == 'success':
                         stats[file_type]['success'] += 1
+                        if on_saved is not None and output_format == 'fits':
+                            on_saved(os.path.join(output_dir, file_type, f"{obj_id}.fits"))
                     else:
                         stats[file_type]['failed'] += 1
                         if verbose and len(stats[file_type]['errors']) < 10:
                             stats[file_type]['errors'].append(f"{obj_id}: {status}")
-            except Exception as e:
-                if verbose:
-                    print(f"\n[CRITICAL ERROR] 处理任务时出错: {str(e)}", file=sys.stderr)
-                for file_type in file_types:
-                    stats[file_type]['failed'] += 1
             
             # 更新进度条描述显示当前统计
             total_success = sum(s['success'] for s in stats.values())
             total_failed = sum(s['failed'] for s in stats.values())
             pbar.set_postfix({'成功': total_success, '失败': total_failed}, refresh=True)
+            pbar.update(len(result_list))
+        
+        pbar.close()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+        # worker退出后再停止日志队列，保证其日志全部输出
+        log_stack.close()
     
     print("\n" + "="*60)
     print("处理统计:")
@@ -8,6 +8,7 @@
 
 import os
 import time
+import queue
 import shutil
 import zipfile
 import logging
@@ -22,7 +23,7 @@ from astropy.table import Table
 import numpy as np
 
 from euclid_service.config import get_config
-from euclid_service.core.euclid_cutout_remix import process_catalog
+from euclid_service.core.euclid_cutout_remix import process_catalog, preload_tile_index
 from euclid_service.core.catalog_processor import load_catalog
 
 logger = logging.getLogger(__name__)
@@ -30,6 +31,37 @@ logger = logging.getLogger(__name__)
 # 加载配置
 config = get_config()
 
+# 写入zip时每次读写的块大小
+ZIP_COPY_BUFFER_SIZE = 1 << 20
+
+# 本进程已创建的缓存目录；缓存目录在任务间共享且不会被清理，只需创建一次
+_created_cache_dirs = set()
+
+
+def _collect_files(root_dir: str) -> List[Tuple[str, str]]:
+    """
+    用os.scandir迭代遍历目录，收集所有文件
+
+    scandir的目录项自带文件类型，不需要对每个文件再stat一次
+
+    Returns:
+        [(文件路径, 相对root_dir的归档名), ...]
+    """
+    files = []
+    stack = [(root_dir, '')]
+    while stack:
+        dir_path, prefix = stack.pop()
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                arcname = f"{prefix}{entry.name}"
+                if entry.is_dir():
+                    # 与os.walk一致，不进入符号链接指向的目录
+                    if not entry.is_symlink():
+                        stack.append((entry.path, f"{arcname}/"))
+                else:
+                    files.append((entry.path, arcname))
+    return files
+
 
 class TaskExecutor:
     """任务执行器 - 处理图像裁剪任务"""
@@ -59,10 +91,20 @@ class TaskExecutor:
         self.data_root = Path(config.get('data.root'))
         self.max_catalog_rows = config.get('limits.max_catalog_rows', 10000)
 
+        # TILE 索引文件路径
+        project_root = Path(__file__).parent.parent.parent
+        self.tile_index_file = str(project_root / 'data' / 'EuclidQ1_tile_coordinates.fits')
+
         # 任务相关路径
         self.permanent_task_dir = os.path.join(self.permanent_download_dir, task_id)
         self.permanent_zip_path = os.path.join(self.permanent_task_dir, f"{task_id}.zip")
         self.task_output_dir = self.tmp_dir / task_id
+        self.task_output_dir_str = str(self.task_output_dir)
+
+        # 边裁剪边打包：裁剪结果文件路径经队列交给打包线程，None为结束标记
+        self._pack_queue: Optional[queue.Queue] = None
+        self._pack_thread: Optional[threading.Thread] = None
+        self._pack_error: Optional[BaseException] = None
 
         # 统计信息
         self.stats = {
@@ -84,8 +126,10 @@ class TaskExecutor:
             if self._check_cached_result():
                 return
 
-            # 3. 创建必要的目录
+            # 3. 创建必要的目录，并启动打包线程
             self._create_directories()
+            self._start_packing()
+            self._warm_cache()
 
             # 4. 加载和验证星表
             catalog = self._load_and_validate_catalog()
@@ -112,64 +156,119 @@ class TaskExecutor:
 
         except Exception as e:
             logger.error(f"任务 {self.task_id} 处理失败: {e}", exc_info=True)
+            self._abort_packing()
             self._update_status('failed', message=f"处理失败: {str(e)}")
 
     def _update_status(self, status: str, progress: Optional[int] = None,
                       message: Optional[str] = None) -> None:
         """更新任务状态"""
+        # 更新内容在锁外准备好，持锁期间只做一次字典查找和update
+        updates = {'status': status}
+        if progress is not None:
+            updates['progress'] = progress
+        if message:
+            updates['message'] = message
+        now = datetime.now().isoformat() if status in ('processing', 'completed', 'failed') else None
+        if status in ('completed', 'failed'):
+            updates['end_time'] = now
+            updates['stats'] = self.stats
+
         with self.tasks_lock:
-            self.tasks[self.task_id]['status'] = status
-            if progress is not None:
-                self.tasks[self.task_id]['progress'] = progress
-            if message:
-                self.tasks[self.task_id]['message'] = message
-            if status == 'processing' and 'start_time' not in self.tasks[self.task_id]:
-                self.tasks[self.task_id]['start_time'] = datetime.now().isoformat()
-            if status in ['completed', 'failed']:
-                self.tasks[self.task_id]['end_time'] = datetime.now().isoformat()
-                self.tasks[self.task_id]['stats'] = self.stats
+            task = self.tasks[self.task_id]
+            if status == 'processing' and 'start_time' not in task:
+                task['start_time'] = now
+            task.update(updates)
 
     def _check_cached_result(self) -> bool:
         """检查是否有缓存的处理结果"""
-        if os.path.exists(self.permanent_zip_path) and os.path.getsize(self.permanent_zip_path) > 0:
+        # 一次stat同时判断存在与大小
+        try:
+            zip_size = os.stat(self.permanent_zip_path).st_size
+        except OSError:
+            zip_size = 0
+        if zip_size > 0:
             logger.info(f"找到已存在的处理结果: {self.permanent_zip_path}")
 
-            with self.tasks_lock:
-                self.tasks[self.task_id]['status'] = 'completed'
-                self.tasks[self.task_id]['end_time'] = datetime.now().isoformat()
-                self.tasks[self.task_id]['zip_path'] = self.permanent_zip_path
-                self.tasks[self.task_id]['message'] = "使用缓存的处理结果"
-                self.tasks[self.task_id]['progress'] = 100
-                self.tasks[self.task_id]['stats'] = {
+            updates = {
+                'status': 'completed',
+                'end_time': datetime.now().isoformat(),
+                'zip_path': self.permanent_zip_path,
+                'message': "使用缓存的处理结果",
+                'progress': 100,
+                'stats': {
                     'total_sources': 0,
                     'cached_sources': 0,
                     'new_sources': 0,
                     'errors': 0,
                     'from_cache': True
                 }
+            }
+            with self.tasks_lock:
+                self.tasks[self.task_id].update(updates)
             return True
         return False
 
     def _create_directories(self) -> None:
-        """创建必要的目录"""
-        os.makedirs(self.permanent_task_dir, exist_ok=True)
-        os.makedirs(self.task_output_dir, exist_ok=True)
+        """创建必要的目录：只对去重后的叶子目录各调用一次makedirs，祖先目录随之创建"""
+        # 各文件类型目录已包含输出根目录，没有文件类型时才单独创建根目录
+        leaves = {os.path.join(self.task_output_dir_str, file_type)
+                  for file_type in self.config["file_types"]} or {self.task_output_dir_str}
+        leaves.add(self.permanent_task_dir)
+        # 缓存目录：之前的任务已创建过的直接跳过
+        cache_leaves = {str(self.cache_dir / instrument)
+                        for instrument in self.config['instruments']} - _created_cache_dirs
+        leaves |= cache_leaves
+
+        for leaf in leaves:
+            os.makedirs(leaf, exist_ok=True)
+        _created_cache_dirs.update(cache_leaves)
+
+    def _warm_cache(self) -> None:
+        """
+        预热TILE索引：提示内核预读索引文件，并在本进程中预先解析索引和KD树，
+        后续process_catalog查询TILE_ID时直接命中缓存
+
+        失败不影响任务，查询时会重新读取
+        """
+        try:
+            if hasattr(os, 'posix_fadvise'):
+                with open(self.tile_index_file, 'rb') as f:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            n_tiles = preload_tile_index(self.tile_index_file)
+            logger.info(f"TILE 索引已预加载: {n_tiles} 个 TILE")
+        except Exception as e:
+            logger.warning(f"预加载 TILE 索引失败: {e}")
 
-        for file_type in self.config["file_types"]:
-            os.makedirs(self.task_output_dir / file_type, exist_ok=True)
+    def _read_catalog(self) -> Tuple[Table, int]:
+        """
+        读取星表的前max_catalog_rows行
 
-        # 创建缓存目录
-        for instrument in self.config['instruments']:
-            cache_instrument_dir = self.cache_dir / instrument
-            os.makedirs(cache_instrument_dir, exist_ok=True)
+        FITS星表通过memmap只读取并复制所需的行，不把整张表读入内存；
+        其他格式完整读取后截取。
+
+        Returns:
+            (星表, 文件中的总行数)
+        """
+        if Path(self.catalog_path).suffix.lower() in ('.fits', '.fit'):
+            with fits.open(self.catalog_path, memmap=True) as hdul:
+                # 与Table.read相同，使用第一个表格HDU
+                table_hdu = next((hdu for hdu in hdul
+                                  if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU))), None)
+                if table_hdu is not None:
+                    n_total = table_hdu.header['NAXIS2']
+                    head_hdu = type(table_hdu)(data=table_hdu.data[:self.max_catalog_rows].copy(),
+                                               header=table_hdu.header)
+                    return Table.read(head_hdu), n_total
+
+        catalog = Table.read(self.catalog_path)
+        return catalog[:self.max_catalog_rows], len(catalog)
 
     def _load_and_validate_catalog(self) -> Table:
         """加载和验证星表"""
-        catalog = Table.read(self.catalog_path)
+        catalog, n_total = self._read_catalog()
 
         # 检查星表大小
-        if len(catalog) > self.max_catalog_rows:
-            catalog = catalog[:self.max_catalog_rows]
+        if n_total > self.max_catalog_rows:
             self._update_status('processing',
                               message=f"星表超过{self.max_catalog_rows}行，仅处理前{self.max_catalog_rows}行")
 
@@ -201,11 +300,12 @@ class TaskExecutor:
     def _detect_column(self, available_cols: List[str], preferred: str,
                       aliases: List[str]) -> str:
         """检测列名"""
-        if preferred in available_cols:
+        available_set = set(available_cols)
+        if preferred in available_set:
             return preferred
 
         for alias in aliases:
-            if alias in available_cols:
+            if alias in available_set:
                 logger.warning(f"未找到列 '{preferred}'，使用替代列 '{alias}'")
                 return alias
 
@@ -227,9 +327,7 @@ class TaskExecutor:
         """处理新源"""
         logger.info(f"开始处理 {len(catalog)} 个新源...")
 
-        # TILE 索引文件路径
-        project_root = Path(__file__).parent.parent.parent
-        tile_index_file = str(project_root / 'data' / 'EuclidQ1_tile_coordinates.fits')
+        tile_index_file = self.tile_index_file
         mer_root_path = self.data_root / 'MER'
 
         # 验证关键路径
@@ -247,7 +345,7 @@ class TaskExecutor:
         # 调用核心裁剪引擎
         process_stats = process_catalog(
             catalog=catalog,
-            output_dir=str(self.task_output_dir),
+            output_dir=self.task_output_dir_str,
             file_types=self.config['file_types'],
             ra_col=self.config['ra_col'],
             dec_col=self.config['dec_col'],
@@ -261,7 +359,8 @@ class TaskExecutor:
             save_catalog_row=True,
             parallel=True,
             n_workers=self.config['n_workers'],
-            verbose=True  # 启用详细输出
+            verbose=True,  # 启用详细输出
+            on_saved=self._pack_queue.put  # 每个文件写出后立即交给打包线程
         )
 
         # 更新统计信息
@@ -275,16 +374,86 @@ class TaskExecutor:
         logger.info(f"复制 {len(cached_info)} 个缓存文件...")
         # TODO: 实现缓存文件复制逻辑
 
+    @property
+    def _partial_zip_path(self) -> str:
+        """打包过程中的临时zip路径，完成后再改名，避免半成品被当作缓存结果"""
+        return f"{self.permanent_zip_path}.part"
+
+    def _start_packing(self) -> None:
+        """启动打包线程，使打包与裁剪同时进行"""
+        self._pack_queue = queue.Queue()
+        self._pack_error = None
+        self._pack_thread = threading.Thread(target=self._pack_worker,
+                                             name=f"euclid-pack-{self.task_id}", daemon=True)
+        self._pack_thread.start()
+
+    def _pack_worker(self) -> None:
+        """
+        打包线程：从队列取出已写出的文件写入zip并删除，收到None后
+        再补充打包目录中未经队列通知的文件
+
+        文件写入zip后即被删除，zip条目也无法替换：同一obj_id在多个批次中
+        重复出现时，zip中保留先写出的裁剪，之后的重写会被跳过并记录警告。
+
+        出错时只记录异常并退出：队列无界，生产者不会因此阻塞，
+        _finish_packing的结束标记和join照常完成，由_package_results抛出异常。
+        """
+        task_output_dir = self.task_output_dir_str
+        packed = set()
+
+        def add(file_path: str, arcname: str) -> None:
+            if arcname in packed:
+                logger.warning(f"任务 {self.task_id}: {arcname} 已打包，重复ID的源再次写出的文件不会写入zip")
+                return
+            # 与zipf.write相同保留文件时间和权限，但以1 MiB块复制，减少系统调用次数
+            zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+            zinfo.compress_type = zipf.compression
+            with open(file_path, 'rb', buffering=ZIP_COPY_BUFFER_SIZE) as src, \
+                    zipf.open(zinfo, 'w', force_zip64=True) as dst:
+                shutil.copyfileobj(src, dst, length=ZIP_COPY_BUFFER_SIZE)
+            packed.add(arcname)
+            os.remove(file_path)
+
+        try:
+            # FITS裁剪图以浮点数据为主，deflate几乎压不小却占用大量CPU，直接存储
+            with zipfile.ZipFile(self._partial_zip_path, 'w', zipfile.ZIP_STORED,
+                                 allowZip64=True) as zipf:
+                while True:
+                    file_path = self._pack_queue.get()
+                    if file_path is None:
+                        break
+                    add(file_path, os.path.relpath(file_path, task_output_dir).replace(os.sep, '/'))
+
+                for file_path, arcname in _collect_files(task_output_dir):
+                    add(file_path, arcname)
+        except Exception as e:
+            self._pack_error = e
+
+    def _finish_packing(self) -> None:
+        """发送结束标记并等待打包线程退出"""
+        if self._pack_thread is None:
+            return
+        self._pack_queue.put(None)
+        self._pack_thread.join()
+        self._pack_thread = None
+
+    def _abort_packing(self) -> None:
+        """任务失败时停止打包线程并删除未完成的zip"""
+        try:
+            self._finish_packing()
+            if os.path.exists(self._partial_zip_path):
+                os.remove(self._partial_zip_path)
+        except Exception as e:
+            logger.warning(f"清理未完成的打包文件失败: {e}")
+
     def _package_results(self) -> None:
-        """打包结果"""
+        """打包结果：等待打包线程完成剩余文件，再将zip改名为最终路径"""
         logger.info(f"开始打包结果到: {self.permanent_zip_path}")
 
-        with zipfile.ZipFile(self.permanent_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(self.task_output_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, self.task_output_dir)
-                    zipf.write(file_path, arcname)
+        self._finish_packing()
+        if self._pack_error is not None:
+            raise self._pack_error
+        os.replace(self._partial_zip_path, self.permanent_zip_path)
 
         zip_size = os.path.getsize(self.permanent_zip_path) / (1024 * 1024)
         logger.info(f"打包完成，文件大小: {zip_size:.2f} MB")
@@ -10,6 +10,7 @@ import logging
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
 
 from euclid_service.core.task_executor import TaskExecutor
 from euclid_service.config import get_config
@@ -34,6 +35,13 @@ class TaskProcessor:
         self.tasks = tasks_dict
         self.tasks_lock = tasks_lock
 
+        # 同时运行的任务数有上限，超出的任务保持pending排队；每个任务内部的
+        # 裁剪已经使用多进程，任务级再无限制地开线程只会互相争抢CPU
+        self._task_pool = ThreadPoolExecutor(
+            max_workers=config.get('limits.max_concurrent_tasks', 2),
+            thread_name_prefix='euclid-task'
+        )
+
     def create_task(self, catalog_path: str, task_config: Dict[str, Any]) -> str:
         """
         创建新任务
@@ -59,7 +67,7 @@ class TaskProcessor:
                 'message': '任务已创建，等待处理'
             }
 
-        # 在后台线程中处理任务
+        # 提交到任务线程池处理
         executor = TaskExecutor(
             task_id=task_id,
             catalog_path=catalog_path,
@@ -68,13 +76,9 @@ class TaskProcessor:
             tasks_lock=self.tasks_lock
         )
 
-        thread = threading.Thread(
-            target=executor.execute,
-            daemon=True
-        )
-        thread.start()
+        self._task_pool.submit(executor.execute)
 
-        logger.info(f"任务 {task_id} 已创建并开始处理")
+        logger.info(f"任务 {task_id} 已创建并提交处理")
 
         return task_id
 
@@ -286,11 +286,13 @@ async def handle_get_cutout_status(arguments: Dict[str, Any]) -> Dict[str, Any]:
         # 添加下载信息
         if task['status'] == 'completed' and 'zip_path' in task:
             zip_path = task['zip_path']
-            if os.path.exists(zip_path):
-                task['zip_size_mb'] = round(os.path.getsize(zip_path) / (1024 * 1024), 2)
-                task['download_ready'] = True
-            else:
+            try:
+                zip_size = os.stat(zip_path).st_size
+            except OSError:
                 task['download_ready'] = False
+            else:
+                task['zip_size_mb'] = round(zip_size / (1024 * 1024), 2)
+                task['download_ready'] = True
 
         return {
             'success': True,
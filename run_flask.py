@@ -22,11 +22,13 @@ if __name__ == "__main__":
         host = config.get('flask.host', '0.0.0.0')
         port = config.get('flask.port', 5000)
         debug = config.get('flask.debug', False)
+        threads = config.get('flask.threads', 8)
     except Exception as e:
         print(f"警告: 无法加载配置文件，使用默认值: {e}")
         host = '0.0.0.0'
         port = 5000
         debug = False
+        threads = 8
 
     print("=" * 60)
     print("🚀 启动 Euclid Image Cutout Flask 服务")
@@ -37,5 +39,17 @@ if __name__ == "__main__":
     print("=" * 60)
     print("\n按 Ctrl+C 停止服务器\n")
 
-    # 启动服务器
-    app.run(host=host, port=port, debug=debug, threaded=True)
+    # 启动服务器：非调试模式优先使用waitress（多线程、单进程，
+    # 任务字典保存在进程内存中，不能使用多进程的WSGI服务器）
+    serve = None
+    if not debug:
+        try:
+            from waitress import serve
+        except ImportError:
+            pass
+
+    if serve is not None:
+        print(f"使用 waitress 启动，工作线程数: {threads}")
+        serve(app, host=host, port=port, threads=threads)
+    else:
+        app.run(host=host, port=port, debug=debug, threaded=True)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 process_catalog_by_tile 的任务进度更新
+
+不依赖 MER 数据：只使用仓库中的TILE索引文件。
+运行: python test/test_process_catalog_by_tile.py
+"""
+
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from astropy.table import Table
+
+from euclid_service.core.euclid_cutout_remix import process_catalog_by_tile
+
+tile_index_file = str(project_root / 'data' / 'EuclidQ1_tile_coordinates.fits')
+
+
+class ProcessCatalogByTileProgressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='euclid-by-tile-')
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_empty_catalog_reports_final_progress(self):
+        """空星表：不除以零，最终进度写为90%"""
+        catalog = Table({'RA': [], 'DEC': []}, dtype=[float, float])
+        tasks = {'t1': {}}
+        stats = process_catalog_by_tile(
+            catalog, self.root, ['BGSUB'], parallel=False,
+            task_id='t1', tasks=tasks, tasks_lock=threading.Lock(),
+            tile_index_file=tile_index_file, mer_root=self.root)
+
+        self.assertEqual(stats, {'BGSUB': {'success': 0, 'failed': 0, 'total': 0}})
+        self.assertEqual(tasks['t1']['progress'], 90)
+        self.assertEqual(tasks['t1']['message'], "正在处理: 0/0")
+
+
+if __name__ == '__main__':
+    unittest.main()
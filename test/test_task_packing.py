@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 TaskExecutor 的边裁剪边打包流程
+
+不依赖 MER 数据：process_catalog 被替换为直接写出小文件并调用 on_saved 的桩函数。
+运行: python test/test_task_packing.py
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+os.environ.setdefault('EUCLID_CONFIG', str(project_root / 'config.yaml'))
+
+from astropy.table import Table
+
+from euclid_service.core import task_executor
+from euclid_service.core.task_executor import TaskExecutor
+
+# 等待打包线程的超时（秒），超时视为线程卡死
+JOIN_TIMEOUT = 10
+
+
+def fake_process_catalog(catalog, output_dir, file_types, on_saved=None, **kwargs):
+    """为每个源的每种文件类型写出一个小文件，并像 process_catalog 一样逐个通知"""
+    for i in range(len(catalog)):
+        for file_type in file_types:
+            path = os.path.join(output_dir, file_type, f"obj{i}.fits")
+            with open(path, 'wb') as f:
+                f.write(f"{file_type}-{i}".encode())
+            if on_saved is not None:
+                on_saved(path)
+    # 一个未经on_saved通知的文件，应由打包线程的最后扫描补充
+    with open(os.path.join(output_dir, 'extra.txt'), 'wb') as f:
+        f.write(b'extra')
+    return {}
+
+
+class TaskPackingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='euclid-pack-')
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+        catalog_path = os.path.join(self.root, 'catalog.fits')
+        Table({'RA': [52.9, 53.0, 53.1], 'DEC': [-28.1, -28.0, -27.9]}).write(catalog_path)
+
+        self.task_config = {
+            'file_types': ['BGSUB', 'RMS'],
+            'instruments': ['VIS'],
+            'ra_col': 'RA',
+            'dec_col': 'DEC',
+            'size': 64,
+            'n_workers': 1,
+        }
+        self.tasks = {'t1': {'status': 'pending'}}
+        self.executor = TaskExecutor('t1', catalog_path, self.task_config,
+                                     self.tasks, threading.Lock())
+        # 所有路径指向临时目录
+        self.executor.permanent_task_dir = os.path.join(self.root, 'download', 't1')
+        self.executor.permanent_zip_path = os.path.join(self.executor.permanent_task_dir, 't1.zip')
+        self.executor.task_output_dir = Path(self.root) / 'tmp' / 't1'
+        self.executor.task_output_dir_str = str(self.executor.task_output_dir)
+        self.executor.cache_dir = Path(self.root) / 'cache'
+
+    def finish_packing(self):
+        """在独立线程中结束打包，避免打包线程卡死时测试一起挂起"""
+        finisher = threading.Thread(target=self.executor._finish_packing, daemon=True)
+        finisher.start()
+        finisher.join(JOIN_TIMEOUT)
+        self.assertFalse(finisher.is_alive(), "打包线程在收到结束标记后没有退出")
+
+    def test_execute_packs_all_files(self):
+        """完整执行任务：通知的文件和最后扫描补充的文件都进入zip"""
+        with mock.patch.object(task_executor, 'process_catalog', side_effect=fake_process_catalog):
+            self.executor.execute()
+
+        self.assertEqual(self.tasks['t1']['status'], 'completed', self.tasks['t1'].get('message'))
+        self.assertEqual(self.tasks['t1']['zip_path'], self.executor.permanent_zip_path)
+        self.assertFalse(os.path.exists(self.executor._partial_zip_path))
+        self.assertFalse(self.executor.task_output_dir.exists())
+
+        with zipfile.ZipFile(self.executor.permanent_zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            names = sorted(zipf.namelist())
+            self.assertEqual(zipf.read('RMS/obj2.fits'), b'RMS-2')
+        expected = sorted([f"{ft}/obj{i}.fits" for ft in ('BGSUB', 'RMS') for i in range(3)]
+                          + ['extra.txt'])
+        self.assertEqual(names, expected)
+
+    def test_duplicate_keeps_first_and_warns(self):
+        """同名文件再次写出时保留先写出的一份，并记录警告"""
+        self.executor._create_directories()
+        self.executor._start_packing()
+        path = os.path.join(self.executor.task_output_dir_str, 'BGSUB', 'dup.fits')
+        with self.assertLogs(task_executor.logger, level='WARNING') as logs:
+            with open(path, 'wb') as f:
+                f.write(b'first')
+            self.executor._pack_queue.put(path)
+            # 等第一份打包并删除后再重写，与实际中重复ID分属不同批次一致
+            deadline = time.monotonic() + JOIN_TIMEOUT
+            while os.path.exists(path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            with open(path, 'wb') as f:
+                f.write(b'second')
+            self.executor._pack_queue.put(path)
+            self.finish_packing()
+        self.assertTrue(any('BGSUB/dup.fits' in line for line in logs.output))
+
+        self.executor._package_results()
+        with zipfile.ZipFile(self.executor.permanent_zip_path) as zipf:
+            self.assertEqual(zipf.namelist(), ['BGSUB/dup.fits'])
+            self.assertEqual(zipf.read('BGSUB/dup.fits'), b'first')
+
+    def test_failure_after_sentinel_does_not_hang(self):
+        """结束标记之后的最后扫描出错：线程退出，任务标记失败，不留下zip"""
+        def failing_collect(root_dir):
+            raise OSError(28, 'No space left on device')
+
+        with mock.patch.object(task_executor, 'process_catalog', side_effect=fake_process_catalog), \
+                mock.patch.object(task_executor, '_collect_files', side_effect=failing_collect):
+            runner = threading.Thread(target=self.executor.execute, daemon=True)
+            runner.start()
+            runner.join(JOIN_TIMEOUT)
+            self.assertFalse(runner.is_alive(), "打包出错后任务没有结束")
+
+        self.assertIsInstance(self.executor._pack_error, OSError)
+        self.assertEqual(self.tasks['t1']['status'], 'failed')
+        self.assertFalse(os.path.exists(self.executor._partial_zip_path))
+        self.assertFalse(os.path.exists(self.executor.permanent_zip_path))
+
+    def test_failure_before_sentinel(self):
+        """结束标记之前出错：之后的通知照常入队，结束时抛出打包错误"""
+        self.executor._create_directories()
+        self.executor._start_packing()
+        missing = os.path.join(self.executor.task_output_dir_str, 'BGSUB', 'missing.fits')
+        self.executor._pack_queue.put(missing)
+        self.executor._pack_queue.put(missing)
+        self.finish_packing()
+
+        self.assertIsInstance(self.executor._pack_error, FileNotFoundError)
+        with self.assertRaises(FileNotFoundError):
+            self.executor._package_results()
+
+
+if __name__ == '__main__':
+    unittest.main()